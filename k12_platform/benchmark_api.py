@@ -0,0 +1,180 @@
+"""接口压测 - 多个用户并发解题、批改作文和聊天，统计各接口吞吐和延迟
+
+默认启动本地的模拟LLM服务（fake_llm_server.py），不访问网络，也不产生模型调用费用；
+设置 LLM_RECORD_MODE=replay 时从录制文件回放，不启动模拟服务。
+
+用法：
+    python benchmark_api.py                                     # 20 个用户、共 200 次请求
+    python benchmark_api.py --users 50 --requests 1000 --mix question=5,essay=2,chat=3
+    python benchmark_api.py --latency uniform:0.5,3 --error-rate 0.05      # 模拟服务的延迟和错误比例
+    LLM_RECORD_MODE=record python benchmark_api.py --llm-url https://api.openai.com/v1   # 录制真实模型的响应
+    LLM_RECORD_MODE=replay python benchmark_api.py                          # 回放录制（请求数和参数需与录制时相同）
+
+使用临时SQLite数据库，在进程内通过ASGI直接调用应用。
+"""
+import os
+import sys
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ESSAY = "那天放学，天空下起了大雨。我站在校门口，看着雨点打在地上溅起水花，心里很着急。" * 6
+
+
+def parse_mix(text: str) -> list:
+    """question=5,essay=2,chat=3 -> 按权重展开的接口列表"""
+    mix = []
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ("question", "essay", "chat"):
+            raise ValueError(f"未知的接口: {name}")
+        mix += [name] * int(weight or 1)
+    return mix
+
+
+def start_fake_llm(args) -> tuple:
+    """在空闲端口启动模拟LLM服务，返回 (进程, base_url)"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen([
+        sys.executable, os.path.join(BASE_DIR, "fake_llm_server.py"), "--port", str(port),
+        "--latency", args.latency, "--chunk-delay", str(args.chunk_delay),
+        "--error-rate", str(args.error_rate), "--seed", str(args.seed)
+    ])
+    import httpx
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/v1/models", timeout=1)
+            break
+        except httpx.TransportError:
+            time.sleep(0.1)
+    else:
+        process.terminate()
+        raise RuntimeError("模拟LLM服务启动失败")
+    return process, f"http://127.0.0.1:{port}/v1"
+
+
+async def run(args, mix: list):
+    import httpx
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    # ASGITransport不触发启动事件，手动启动作文批改队列等后台任务
+    await app.router.startup()
+    clients = [httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) for _ in range(args.users)]
+    try:
+        print(f"正在注册 {args.users} 个用户...")
+        await asyncio.gather(*[
+            client.post("/api/register", data={"username": f"load{i}", "password": "password123"})
+            for i, client in enumerate(clients)
+        ])
+
+        rng = random.Random(args.seed)
+        # 每个用户的请求序列固定，回放时与录制时的请求一致
+        plans = [[rng.choice(mix) for _ in range(args.requests // args.users)] for _ in range(args.users)]
+        results = {name: {"latencies": [], "statuses": {}} for name in ("question", "essay", "chat")}
+
+        async def question(client, user: int, step: int):
+            n = (user * 7 + step) % args.distinct
+            return await client.post("/api/question", data={"content": f"解方程 {n + 2}x + {n % 9} = {n * 3 + 11}"})
+
+        async def essay(client, user: int, step: int):
+            r = await client.post("/api/essay", data={"title": f"难忘的一天（{user}-{step}）", "content": ESSAY})
+            if r.status_code != 200:
+                return r
+            job_id = r.json()["job_id"]
+            while True:
+                await asyncio.sleep(0.05)
+                r = await client.get(f"/api/essay/jobs/{job_id}")
+                if r.status_code != 200 or r.json()["status"] in ("done", "failed"):
+                    return r
+
+        sessions = {}
+
+        async def chat(client, user: int, step: int):
+            payload = {"message": f"第{step + 1}个问题：一元一次方程怎么移项？", "session_id": sessions.get(user)}
+            r = await client.post("/api/chat", json=payload)
+            if r.status_code == 200:
+                sessions[user] = r.json()["session_id"]
+            return r
+
+        handlers = {"question": question, "essay": essay, "chat": chat}
+
+        async def simulate(user: int):
+            for step, name in enumerate(plans[user]):
+                start = time.perf_counter()
+                r = await handlers[name](clients[user], user, step)
+                status = r.status_code
+                if name == "essay" and status == 200 and r.json()["status"] == "failed":
+                    status = "failed"
+                results[name]["latencies"].append(time.perf_counter() - start)
+                results[name]["statuses"][status] = results[name]["statuses"].get(status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[simulate(i) for i in range(args.users)])
+        elapsed = time.perf_counter() - start
+        stats = (await clients[0].get("/api/llm/stats")).json()
+    finally:
+        for client in clients:
+            await client.aclose()
+        await app.router.shutdown()
+
+    total = sum(len(result["latencies"]) for result in results.values())
+    print(f"\n📊 {total} 次请求，{args.users} 个并发用户，耗时 {elapsed:.2f}s，吞吐 {total / elapsed:.1f} 次/秒")
+    for name, result in results.items():
+        latencies = sorted(result["latencies"])
+        if not latencies:
+            continue
+        print(f"   {name:<8} {len(latencies):>5} 次  p50 {latencies[len(latencies) // 2] * 1000:>7.0f}ms  "
+              f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:>7.0f}ms  状态 {result['statuses']}")
+    upstream = stats["upstream"]
+    print(f"   LLM: 重试 {upstream['retries']} 次，熔断状态 {upstream['breaker']['state']}，"
+          f"录制回放 {upstream['recording']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="解题、作文批改、聊天接口压测")
+    parser.add_argument("--users", type=int, default=20, help="并发用户数")
+    parser.add_argument("--requests", type=int, default=200, help="请求总数（平均分给各用户）")
+    parser.add_argument("--mix", default="question=5,essay=2,chat=3", help="各接口的请求比例")
+    parser.add_argument("--distinct", type=int, default=50, help="不同题目的数量（重复的题目会命中解答缓存）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--llm-url", default="", help="使用已有的LLM服务，不启动模拟服务")
+    parser.add_argument("--latency", default="lognormal:0.8,0.5", help="模拟服务的延迟分布，见 fake_llm_server.py")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="模拟服务流式输出每段的间隔（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务返回500的比例")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    tmp_dir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'load.db')}"
+    os.environ["ANSWER_CACHE_DB"] = ""
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    os.environ.setdefault("LOGIN_MAX_FAILURES_PER_IP", "1000000")
+    os.chdir(BASE_DIR)
+    sys.path.insert(0, BASE_DIR)
+
+    process = None
+    if args.llm_url:
+        os.environ["OPENAI_BASE_URL"] = args.llm_url
+    elif os.getenv("LLM_RECORD_MODE", "off").lower() != "replay":
+        process, os.environ["OPENAI_BASE_URL"] = start_fake_llm(args)
+    try:
+        from models.database import init_db
+        init_db()
+        asyncio.run(run(args, mix))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
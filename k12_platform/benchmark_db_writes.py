@@ -0,0 +1,149 @@
+"""数据库并发写入基准测试 - 对比SQLite默认设置与 .env 中的调优设置
+
+多个线程同时写入聊天消息（每次写入单独提交），另有线程持续读取，统计写入吞吐、延迟和失败次数。
+
+用法：
+    python benchmark_db_writes.py
+    python benchmark_db_writes.py --writers 16 --readers 4 --writes 200
+
+每种配置在独立子进程中使用新的临时数据库运行，不影响 k12_platform.db。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# SQLite和SQLAlchemy的默认值（即调优前的行为）
+DEFAULT_SETTINGS = {
+    "SQLITE_JOURNAL_MODE": "DELETE",
+    "SQLITE_SYNCHRONOUS": "FULL",
+    "SQLITE_BUSY_TIMEOUT_MS": "5000",
+    "SQLITE_MMAP_SIZE": "0",
+    "SQLITE_CACHE_SIZE_KB": "2000",
+    "DB_POOL_SIZE": "5",
+    "DB_MAX_OVERFLOW": "10",
+}
+
+
+def worker(writers: int, readers: int, writes: int):
+    """在当前进程中执行一轮测试，结果以JSON输出"""
+    sys.path.insert(0, BASE_DIR)
+    from models.database import init_db, SessionLocal, User, ChatSession, ChatMessage
+
+    init_db()
+    db = SessionLocal()
+    user = User(username="bench", password_hash="x")
+    db.add(user)
+    db.flush()
+    session = ChatSession(user_id=user.id, title="bench")
+    db.add(session)
+    db.commit()
+    session_id = session.id
+    db.close()
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    stop = threading.Event()
+    reads = [0]
+
+    def write_loop(n: int):
+        for i in range(writes):
+            start = time.perf_counter()
+            db = SessionLocal()
+            try:
+                db.add(ChatMessage(session_id=session_id, role="user", content=f"writer {n} message {i} " * 10))
+                db.commit()
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                with lock:
+                    errors.append(type(e).__name__)
+            finally:
+                db.close()
+
+    def read_loop():
+        while not stop.is_set():
+            db = SessionLocal()
+            try:
+                db.query(ChatMessage).filter(ChatMessage.session_id == session_id).order_by(
+                    ChatMessage.id.desc()).limit(20).all()
+                with lock:
+                    reads[0] += 1
+            except Exception as e:
+                with lock:
+                    errors.append(type(e).__name__)
+            finally:
+                db.close()
+
+    reader_threads = [threading.Thread(target=read_loop) for _ in range(readers)]
+    writer_threads = [threading.Thread(target=write_loop, args=(n,)) for n in range(writers)]
+    for t in reader_threads:
+        t.start()
+    start = time.perf_counter()
+    for t in writer_threads:
+        t.start()
+    for t in writer_threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for t in reader_threads:
+        t.join()
+
+    latencies.sort()
+    print(json.dumps({
+        "elapsed": elapsed,
+        "writes": len(latencies),
+        "errors": len(errors),
+        "error_types": sorted(set(errors)),
+        "reads": reads[0],
+        "p50": latencies[len(latencies) // 2] if latencies else 0,
+        "p99": latencies[int(len(latencies) * 0.99)] if latencies else 0,
+    }))
+
+
+def run(label: str, overrides: dict, args) -> dict:
+    tmp_dir = tempfile.mkdtemp()
+    env = dict(os.environ, **overrides)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker",
+         "--writers", str(args.writers), "--readers", str(args.readers), "--writes", str(args.writes)],
+        env=env, cwd=BASE_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+
+    print(f"\n📊 {label}")
+    print(f"   写入 {result['writes']} 次，耗时 {result['elapsed']:.2f}s，吞吐 {result['writes'] / result['elapsed']:.0f} 次/秒")
+    print(f"   写入延迟 p50 {result['p50'] * 1000:.1f}ms，p99 {result['p99'] * 1000:.1f}ms")
+    print(f"   同期读取 {result['reads']} 次，失败 {result['errors']} 次 {result['error_types'] or ''}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据库并发写入基准测试")
+    parser.add_argument("--writers", type=int, default=8, help="写入线程数")
+    parser.add_argument("--readers", type=int, default=4, help="读取线程数")
+    parser.add_argument("--writes", type=int, default=100, help="每个写入线程的写入次数")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.writers, args.readers, args.writes)
+        return
+
+    print(f"{args.writers} 个写入线程 × {args.writes} 次，{args.readers} 个读取线程")
+    baseline = run("SQLite默认设置（rollback journal, synchronous=FULL）", DEFAULT_SETTINGS, args)
+    tuned = run("调优设置（当前 .env / config.py）", {}, args)
+    speedup = (tuned["writes"] / tuned["elapsed"]) / max(baseline["writes"] / baseline["elapsed"], 1e-9)
+    print(f"\n写入吞吐提升 {speedup:.1f} 倍")
+
+
+if __name__ == "__main__":
+    main()
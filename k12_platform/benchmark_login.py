@@ -0,0 +1,94 @@
+"""登录吞吐基准测试 - 并发登录时的每秒登录数，以及同时进行的轻量请求延迟
+
+用法：
+    python benchmark_login.py                       # 默认 20 个用户、并发 20、共 100 次登录
+    python benchmark_login.py --users 100 --concurrency 50 --logins 500
+    BCRYPT_ROUNDS=10 PASSWORD_HASH_WORKERS=8 python benchmark_login.py   # 对比不同配置
+
+使用临时SQLite数据库，在进程内通过ASGI直接调用应用，不需要启动服务，也不会调用LLM。
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+async def run(users: int, concurrency: int, logins: int):
+    import httpx
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"正在注册 {users} 个用户...")
+        await asyncio.gather(*[
+            client.post("/api/register", data={"username": f"bench{i}", "password": "password123"})
+            for i in range(users)
+        ])
+
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        failures = 0
+
+        async def login(i: int):
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                r = await client.post("/api/login", data={"username": f"bench{i % users}", "password": "password123"})
+                latencies.append(time.perf_counter() - start)
+                if r.status_code != 200:
+                    failures += 1
+
+        # 登录高峰期间持续请求一个轻量接口，观察事件循环是否被阻塞
+        probe_latencies = []
+        done = asyncio.Event()
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get("/api/cache/stats")
+                probe_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*[login(i) for i in range(logins)])
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+
+    latencies.sort()
+    probe_latencies.sort()
+    print(f"\n📊 {logins} 次登录，并发 {concurrency}，耗时 {elapsed:.2f}s")
+    print(f"   吞吐: {logins / elapsed:.1f} 次/秒，失败 {failures} 次")
+    print(f"   登录延迟 p50 {latencies[len(latencies) // 2] * 1000:.0f}ms，"
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.0f}ms")
+    if probe_latencies:
+        print(f"   轻量请求延迟 p50 {probe_latencies[len(probe_latencies) // 2] * 1000:.1f}ms，"
+              f"最大 {probe_latencies[-1] * 1000:.1f}ms（共 {len(probe_latencies)} 次）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="登录吞吐基准测试")
+    parser.add_argument("--users", type=int, default=20, help="注册的用户数")
+    parser.add_argument("--concurrency", type=int, default=20, help="同时进行的登录数")
+    parser.add_argument("--logins", type=int, default=100, help="登录总次数")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+    # 基准测试中的登录都是成功的，放宽限流避免同一IP被拦截
+    os.environ.setdefault("LOGIN_MAX_FAILURES_PER_IP", "1000000")
+    os.chdir(BASE_DIR)
+    sys.path.insert(0, BASE_DIR)
+
+    from config import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS
+    print(f"bcrypt rounds={BCRYPT_ROUNDS}，哈希线程数={PASSWORD_HASH_WORKERS}")
+    asyncio.run(run(args.users, args.concurrency, args.logins))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,94 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "sk-your-api-key-here")
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
 
+# LLM 调用配置
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # 单次请求超时（秒）
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "90"))  # 一次调用（含重试）的总时限（秒）
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))  # 建立连接超时（秒）
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))  # 连接池最大连接数
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))  # 保持长连接数
+
+# LLM 准入调度配置（每个进程独立计数）
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))  # 同时进行的LLM调用上限
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))  # 每分钟token预算（提示词估算+max_tokens），0表示不限制
+LLM_QUEUE_INTERACTIVE = int(os.getenv("LLM_QUEUE_INTERACTIVE", "64"))  # 解题、聊天的排队上限
+LLM_QUEUE_RECOMMEND = int(os.getenv("LLM_QUEUE_RECOMMEND", "16"))  # 练习推荐的排队上限
+LLM_QUEUE_BATCH = int(os.getenv("LLM_QUEUE_BATCH", "64"))  # 作文批改、会话摘要等后台调用的排队上限
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))  # 排队等待超时（秒），超时按过载处理
+
+# LLM 重试、对冲请求与熔断配置
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "2"))  # 连接失败、超时、429、5xx时的最大重试次数
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))  # 重试退避基数（秒），按指数增长并加随机抖动
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))  # 单次退避上限（秒）
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() == "true"  # 解题、聊天请求超过近期p95耗时仍未返回时，再发一个相同请求，取先返回的
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))  # 对冲请求的最短等待（秒）
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))  # 连续失败多少次后熔断
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))  # 熔断持续时间（秒），之后放行一个探测请求
+
+# LLM 结构化输出配置
+LLM_JSON_MODE = os.getenv("LLM_JSON_MODE", "true").lower() == "true"  # 解题、批改、推荐请求JSON输出（response_format），上游不支持时自动关闭
+LLM_JSON_REPAIR = os.getenv("LLM_JSON_REPAIR", "true").lower() == "true"  # 本地修复失败时让模型按格式修复一次输出，而不是整个任务重新生成
+
+# LLM 录制与回放配置（离线压测、CI）
+LLM_RECORD_MODE = os.getenv("LLM_RECORD_MODE", "off").lower()  # off；record：把上游响应保存到 LLM_RECORD_DIR；replay：只从录制文件返回，不访问上游
+LLM_RECORD_DIR = os.getenv("LLM_RECORD_DIR", "./llm_recordings")  # 录制文件目录
+LLM_REPLAY_SPEED = float(os.getenv("LLM_REPLAY_SPEED", "1"))  # 回放时按录制耗时等待的倍数，0为不等待
+
+# 解答缓存配置
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(60 * 60 * 24)))  # 缓存有效期（秒）
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))  # 进程内最大条目数
+ANSWER_CACHE_DB = os.getenv("ANSWER_CACHE_DB", "")  # SQLite共享缓存文件路径，留空则只用进程内缓存
+ANSWER_CACHE_PRUNE_INTERVAL = int(os.getenv("ANSWER_CACHE_PRUNE_INTERVAL", "600"))  # 共享缓存清理过期条目的间隔（秒）
+
+# 聊天上下文配置
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", "6"))  # 刷新摘要时原样保留的最近对话轮数
+CHAT_SUMMARY_TRIGGER_TURNS = int(os.getenv("CHAT_SUMMARY_TRIGGER_TURNS", "4"))  # 窗口外累计多少轮后刷新摘要
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "3000"))  # 发送给LLM的历史消息token上限（估算）
+CHAT_HISTORY_CACHE_SIZE = int(os.getenv("CHAT_HISTORY_CACHE_SIZE", "1000"))  # 进程内缓存的会话数
+
+# 作文批改任务队列配置
+ESSAY_WORKERS = int(os.getenv("ESSAY_WORKERS", "4"))  # 同时批改的作文数
+ESSAY_BATCH_PARALLELISM = int(os.getenv("ESSAY_BATCH_PARALLELISM", "8"))  # 批量批改时的并发上限
+ESSAY_BATCH_MAX = int(os.getenv("ESSAY_BATCH_MAX", "100"))  # 单次批量批改的最大篇数
+ESSAY_JOB_STALE_SECONDS = int(os.getenv("ESSAY_JOB_STALE_SECONDS", "300"))  # 批改中的任务超过该时间未完成视为所在进程已退出，重新排队
+
+# 练习题库配置
+EXERCISE_FRESH_DAYS = int(os.getenv("EXERCISE_FRESH_DAYS", "30"))  # LLM生成的题目在题库中保持新鲜的天数
+RECOMMEND_COUNT = int(os.getenv("RECOMMEND_COUNT", "3"))  # 每次推荐的题目数
+
+# 图片上传配置
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1600"))  # 题目图片最长边（像素），超过则缩小
+IMAGE_THUMB_EDGE = int(os.getenv("IMAGE_THUMB_EDGE", "320"))  # 缩略图最长边（像素）
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))  # 重新压缩的JPEG质量
+UPLOAD_MAX_BYTES = int(float(os.getenv("UPLOAD_MAX_MB", "10")) * 1024 * 1024)  # 单张图片上传大小上限（MB）
+
 # 数据库配置
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./k12_platform.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))  # 连接池常驻连接数
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))  # 高峰时允许额外创建的连接数
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # 等待空闲连接的超时（秒）
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # 连接最长复用时间（秒），避免被服务端断开的空闲连接
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"  # 取出连接前先检测是否可用
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))  # 建立数据库连接的超时（秒，PostgreSQL）
+
+# SQLite配置（每个连接建立时执行对应的PRAGMA）
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")  # WAL模式下读写互不阻塞
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # WAL下NORMAL只在检查点时fsync，断电不会损坏数据库
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))  # 等待写锁的超时（毫秒）
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # 内存映射读取的大小（字节），0为关闭
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))  # 每个连接的页缓存大小（KB）
 
 # JWT配置
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7天
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))  # 已验证令牌的缓存条数
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "300"))  # 已验证令牌的缓存时间（秒）
+
+# 密码哈希与登录限流配置
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # bcrypt计算成本，每加1耗时翻倍
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))  # 密码哈希线程数
+LOGIN_THROTTLE_WINDOW = int(os.getenv("LOGIN_THROTTLE_WINDOW", "300"))  # 登录失败计数窗口（秒）
+LOGIN_MAX_FAILURES_PER_USER = int(os.getenv("LOGIN_MAX_FAILURES_PER_USER", "5"))  # 窗口内同一用户名最多失败次数
+LOGIN_MAX_FAILURES_PER_IP = int(os.getenv("LOGIN_MAX_FAILURES_PER_IP", "30"))  # 窗口内同一IP最多失败次数
+TRUSTED_PROXIES = [p.strip() for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip()]  # 可信反向代理的IP或网段，来自这些地址的请求按 X-Forwarded-For 取客户端IP
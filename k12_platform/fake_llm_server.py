@@ -0,0 +1,259 @@
+"""模拟LLM服务 - 本地的OpenAI兼容接口，用于离线压测和CI，不调用真实模型
+
+按系统提示词识别任务（解题、作文批改、练习推荐、会话摘要、聊天），返回对应格式的固定内容；
+相同的输入总是得到相同的输出。支持流式输出、可配置的延迟分布和按比例注入的错误。
+
+用法：
+    python fake_llm_server.py                                   # 监听 127.0.0.1:9000
+    python fake_llm_server.py --latency lognormal:0.8,0.5 --chunk-delay 0.03
+    python fake_llm_server.py --error-rate 0.05 --rate-limit-rate 0.02 --seed 42
+
+然后在 .env 中设置 OPENAI_BASE_URL=http://127.0.0.1:9000/v1 启动平台。
+
+--latency 为首个token的等待时间分布（秒），可选：
+    fixed:0.5  uniform:0.2,1.5  lognormal:中位数,sigma  exp:均值
+之后每段输出再等待 --chunk-delay 秒；非流式请求等待同样的总时长后一次返回。
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+KNOWLEDGE_POINTS = ["一元一次方程", "移项", "因式分解", "勾股定理", "分数运算", "二次函数", "相似三角形", "概率初步"]
+
+app = FastAPI(title="模拟LLM服务")
+settings = {
+    "latency": lambda: 0.0,
+    "chunk_delay": 0.0,
+    "chunk_size": 8,
+    "error_rate": 0.0,
+    "rate_limit_rate": 0.0,
+    "random": random.Random(0)
+}
+counters = {"requests": 0, "streams": 0, "errors": 0, "rate_limited": 0}
+
+
+def parse_latency(spec: str, rng: random.Random):
+    """解析延迟分布，返回采样函数"""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: rng.lognormvariate(0, sigma) * median
+    if kind == "exp":
+        return lambda: rng.expovariate(1 / values[0])
+    raise ValueError(f"未知的延迟分布: {spec}")
+
+
+def _seed(text: str) -> int:
+    return int(hashlib.sha256(text.encode()).hexdigest()[:8], 16)
+
+
+def _text_of(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if part.get("type") == "text")
+    return content
+
+
+def solution(question: str) -> dict:
+    n = _seed(question)
+    points = [KNOWLEDGE_POINTS[n % len(KNOWLEDGE_POINTS)], KNOWLEDGE_POINTS[(n // 7) % len(KNOWLEDGE_POINTS)]]
+    return {
+        "answer": f"x = {n % 97}",
+        "steps": [
+            f"步骤1：审题，题目为「{question[:30]}」",
+            "步骤2：列出等量关系并整理",
+            f"步骤3：求解得 x = {n % 97}",
+            "步骤4：代入原式检验"
+        ],
+        "knowledge_points": list(dict.fromkeys(points)),
+        "tips": "先找等量关系，再逐步化简"
+    }
+
+
+def essay_review(text: str) -> dict:
+    n = _seed(text)
+    score = 60 + n % 36
+    return {
+        "overall_score": score,
+        "topic_analysis": {
+            "possible_themes": ["成长", "亲情", "坚持"],
+            "examiner_purpose": "考查对题目的理解和选材能力",
+            "key_points": "围绕中心选取典型事例",
+            "common_mistakes": ["偏离题意", "事例堆砌"]
+        },
+        "structure": {"score": score - 3, "feedback": "结构完整，层次清楚", "suggestions": ["开头可以更简洁"]},
+        "grammar": {"score": min(score + 4, 100), "feedback": "语句基本通顺", "errors": []},
+        "vocabulary": {"score": score, "feedback": "用词准确", "highlights": ["生动的比喻"], "improvements": ["减少重复用词"]},
+        "overall_feedback": "内容充实，中心明确，细节描写还可以加强。",
+        "suggestions": ["增加细节描写", "结尾呼应开头"]
+    }
+
+
+def exercises(request_text: str) -> list:
+    count_match = re.search(r"请生成(\d+)道", request_text)
+    points_match = re.search(r"薄弱知识点：(.+)", request_text)
+    count = int(count_match.group(1)) if count_match else 3
+    points = [p.strip() for p in (points_match.group(1) if points_match else "综合").split(",") if p.strip()]
+    n = _seed(request_text)
+    return [
+        {
+            "question": f"【{points[i % len(points)]}】练习{n % 1000}-{i + 1}：计算 {i + 2}x + {n % 9} = {i * 3 + 11}",
+            "options": ["A. 1", "B. 2", "C. 3", "D. 4"],
+            "answer": "ABCD"[(n + i) % 4],
+            "explanation": "移项后两边同除以系数即可",
+            "knowledge_point": points[i % len(points)],
+            "difficulty": 1 + (n + i) % 5
+        }
+        for i in range(count)
+    ]
+
+
+def reply(body: dict) -> str:
+    """按任务生成回复内容"""
+    messages = body.get("messages") or []
+    system = _text_of(messages[0]) if messages else ""
+    user = _text_of(messages[-1]) if messages else ""
+    json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+
+    def as_json(value) -> str:
+        text = json.dumps(value, ensure_ascii=False, indent=2)
+        # 未请求JSON模式时像真实模型一样包在代码块里
+        return text if json_mode else f"```json\n{text}\n```"
+
+    if "整理成JSON" in system:
+        return user
+    if "K12" in system:
+        return as_json(solution(user))
+    if "语文老师" in system:
+        return as_json(essay_review(user))
+    if "教育专家" in system:
+        items = exercises(user)
+        return as_json({"exercises": items} if json_mode else items)
+    if "摘要" in system:
+        return "学生正在复习初中数学，关注方程和函数，希望得到分步骤讲解。"
+    n = _seed(user)
+    return f"这是模拟回复{n % 1000}。关于「{user[:20]}」，建议先回顾课本上的相关概念，再做几道典型例题巩固，遇到困难随时提问。"
+
+
+def _chunks(text: str) -> list:
+    size = settings["chunk_size"]
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def _usage(body: dict, content: str) -> dict:
+    prompt = sum(len(_text_of(m)) for m in body.get("messages") or [])
+    return {"prompt_tokens": prompt, "completion_tokens": len(content), "total_tokens": prompt + len(content)}
+
+
+def _error(status: int, message: str, headers: dict = None) -> JSONResponse:
+    return JSONResponse({"error": {"message": message, "type": "fake_error", "code": status}},
+                        status_code=status, headers=headers)
+
+
+@app.get("/v1/models")
+async def models():
+    return {"object": "list", "data": [{"id": "fake-model", "object": "model", "owned_by": "fake"}]}
+
+
+@app.get("/stats")
+async def stats():
+    return counters
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    counters["requests"] += 1
+    rng = settings["random"]
+    roll = rng.random()
+    if roll < settings["rate_limit_rate"]:
+        counters["rate_limited"] += 1
+        return _error(429, "Rate limit reached (fake)", {"Retry-After": "1"})
+    if roll < settings["rate_limit_rate"] + settings["error_rate"]:
+        counters["errors"] += 1
+        return _error(500, "Internal error (fake)")
+
+    content = reply(body)
+    chunks = _chunks(content)
+    first_token = max(settings["latency"](), 0)
+    completion_id = f"chatcmpl-fake-{counters['requests']}"
+    model = body.get("model", "fake-model")
+
+    if body.get("stream"):
+        counters["streams"] += 1
+
+        async def events():
+            await asyncio.sleep(first_token)
+            for i, piece in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(settings["chunk_delay"])
+                data = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+            done = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+            }
+            yield f"data: {json.dumps(done)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(first_token + settings["chunk_delay"] * (len(chunks) - 1))
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": _usage(body, content)
+    }
+
+
+def configure(latency: str = "fixed:0", chunk_delay: float = 0.0, chunk_size: int = 8,
+              error_rate: float = 0.0, rate_limit_rate: float = 0.0, seed: int = 0):
+    """设置延迟分布和错误比例（命令行参数，或在进程内直接使用 app 时调用）"""
+    rng = random.Random(seed)
+    settings.update(
+        latency=parse_latency(latency, rng),
+        chunk_delay=chunk_delay,
+        chunk_size=max(chunk_size, 1),
+        error_rate=error_rate,
+        rate_limit_rate=rate_limit_rate,
+        random=rng
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的OpenAI兼容LLM服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", default="lognormal:0.8,0.5", help="首个token的等待时间分布")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="流式输出每段之间的间隔（秒）")
+    parser.add_argument("--chunk-size", type=int, default=8, help="每段输出的字符数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回429的比例")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子，相同种子下延迟和错误序列相同")
+    args = parser.parse_args()
+
+    configure(args.latency, args.chunk_delay, args.chunk_size, args.error_rate, args.rate_limit_rate, args.seed)
+    import uvicorn
+    print(f"🤖 模拟LLM服务: http://{args.host}:{args.port}/v1（延迟 {args.latency}）")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
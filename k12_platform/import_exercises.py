@@ -0,0 +1,61 @@
+"""题库导入脚本 - 从JSON或CSV批量导入练习题
+
+JSON：题目对象数组，字段与推荐接口一致
+    [{"subject": "数学", "question": "...", "options": ["A. ..."], "answer": "A",
+      "explanation": "...", "knowledge_point": "...", "difficulty": 3}]
+CSV：表头为 subject,knowledge_point,difficulty,question,options,answer,explanation，
+    options 用 | 分隔
+
+用法：python import_exercises.py exercises.json [--subject 数学]
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+from models.database import init_db, SessionLocal
+from services import exercise_service
+
+
+def load_items(path: str) -> list:
+    """读取JSON或CSV文件"""
+    if path.lower().endswith(".csv"):
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            items = list(csv.DictReader(f))
+        for item in items:
+            item["options"] = [o.strip() for o in (item.get("options") or "").split("|") if o.strip()]
+        return items
+    
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导入练习题到题库")
+    parser.add_argument("path", help="JSON或CSV文件路径")
+    parser.add_argument("--subject", default="数学", help="题目未指定学科时使用的学科")
+    args = parser.parse_args()
+    
+    if not os.path.exists(args.path):
+        print(f"❌ 文件不存在: {args.path}")
+        sys.exit(1)
+    
+    try:
+        items = load_items(args.path)
+    except Exception as e:
+        print(f"❌ 文件解析失败: {str(e)}")
+        sys.exit(1)
+    
+    init_db()
+    db = SessionLocal()
+    try:
+        saved = exercise_service.save_exercises(db, args.subject, items, source="import")
+        db.commit()
+        print(f"✅ 导入完成：共 {len(items)} 条，成功 {len(saved)} 条")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
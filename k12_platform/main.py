@@ -2,17 +2,25 @@
 import os
 import json
 import base64
+import asyncio
 from datetime import datetime
-from fastapi import FastAPI, Request, Depends, HTTPException, Form, UploadFile, File
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi import FastAPI, Request, Depends, HTTPException, Form, UploadFile, File, BackgroundTasks
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-
-from models.database import init_db, get_db, User, Question, Answer, Essay, WrongQuestion, ChatSession, ChatMessage
-from services.auth_service import hash_password, verify_password, create_access_token, get_current_user, require_auth
+from starlette.background import BackgroundTask
+from sqlalchemy import select, update, func
+from sqlalchemy.orm import joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.database import init_db, get_db, AsyncSessionLocal, User, Question, Answer, WrongQuestion, ChatSession, ChatMessage, EssayJob
+from config import RECOMMEND_COUNT, ESSAY_BATCH_PARALLELISM, ESSAY_BATCH_MAX, UPLOAD_MAX_BYTES
+from services.auth_service import hash_password, verify_password, create_access_token, get_current_user, require_auth, login_throttle, revoke_token, client_ip
 from services.llm_service import llm_service
+from services.llm_scheduler import llm_scheduler, LLMOverloaded
+from services.cache_service import answer_cache
+from services import stats_service, knowledge_service, exercise_service, essay_service, chat_context, image_service
+from services.essay_service import essay_queue
 
 app = FastAPI(title="K12智慧教育平台")
 
@@ -24,6 +32,73 @@ templates = Jinja2Templates(directory="templates")
 init_db()
 
 
+class UploadSizeLimit:
+    """提前拒绝过大的图片上传，不等表单解析完（留出其他表单字段的余量）
+
+    有 Content-Length 时直接按长度拒绝；分块上传没有长度，按已收到的字节数计，超过上限即中止读取。
+    """
+    
+    paths = {"/api/question", "/api/question/stream"}
+    limit = UPLOAD_MAX_BYTES + 1024 * 1024
+    detail = f"图片不能超过{UPLOAD_MAX_BYTES // (1024 * 1024)}MB"
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.limit:
+            response = JSONResponse({"detail": self.detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    # 在读取请求体的路由中抛出，由异常处理返回413
+                    raise HTTPException(status_code=413, detail=self.detail)
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+
+app.add_middleware(UploadSizeLimit)
+
+
+@app.exception_handler(LLMOverloaded)
+async def llm_overloaded_handler(request: Request, exc: LLMOverloaded):
+    """LLM调用排队已满时快速返回429/503，提示客户端稍后重试"""
+    return JSONResponse(
+        {"detail": str(exc)},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+@app.on_event("startup")
+async def startup():
+    """启动作文批改队列和解答缓存的定时清理"""
+    await essay_queue.start()
+    await answer_cache.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """停止作文批改队列和缓存清理，关闭LLM连接池"""
+    await essay_queue.stop()
+    await answer_cache.stop()
+    await llm_service.aclose()
+
+
 # ==================== 页面路由 ====================
 
 @app.get("/", response_class=HTMLResponse)
@@ -161,25 +236,28 @@ async def register(
     email: str = Form(""),
     grade: str = Form(""),
     subjects: str = Form(""),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """用户注册"""
     # 检查用户名是否存在
-    existing = db.query(User).filter(User.username == username).first()
+    existing = await db.scalar(select(User).where(User.username == username))
     if existing:
         raise HTTPException(status_code=400, detail="用户名已存在")
     
+    # 哈希期间不占用数据库连接，避免并发注册时连接池被占满
+    await db.close()
+    password_hash = await hash_password(password)
+    
     # 创建用户
     user = User(
         username=username,
-        password_hash=hash_password(password),
+        password_hash=password_hash,
         email=email,
         grade=grade,
         subjects=subjects
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
     
     # 创建token
     token = create_access_token({"sub": str(user.id), "username": user.username})
@@ -191,18 +269,32 @@ async def register(
 
 @app.post("/api/login")
 async def login(
+    request: Request,
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """用户登录"""
-    user = db.query(User).filter(User.username == username).first()
-    if not user or not verify_password(password, user.password_hash):
+    ip = client_ip(request)
+    retry_after = login_throttle.retry_after(username, ip)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail=f"登录失败次数过多，请{retry_after}秒后再试",
+            headers={"Retry-After": str(retry_after)}
+        )
+    
+    user = await db.scalar(select(User).where(User.username == username))
+    # 校验密码期间不占用数据库连接，避免并发登录时连接池被占满
+    await db.close()
+    if not user or not await verify_password(password, user.password_hash):
+        login_throttle.record_failure(username, ip)
         raise HTTPException(status_code=400, detail="用户名或密码错误")
+    login_throttle.reset(username)
     
     # 更新最后登录时间
-    user.last_login = datetime.now()
-    db.commit()
+    await db.execute(update(User).where(User.id == user.id).values(last_login=datetime.now()))
+    await db.commit()
     
     # 创建token
     token = create_access_token({"sub": str(user.id), "username": user.username})
@@ -213,54 +305,42 @@ async def login(
 
 
 @app.post("/api/logout")
-async def logout():
-    """退出登录"""
+async def logout(request: Request):
+    """退出登录（同时吊销令牌）"""
+    await revoke_token(request)
     response = JSONResponse({"message": "已退出"})
     response.delete_cookie("access_token")
     return response
 
 
-@app.post("/api/question")
-async def submit_question(
-    request: Request,
-    content: str = Form(""),
-    subject: str = Form("数学"),
-    image: UploadFile = File(None),
-    user=Depends(require_auth),
-    db: Session = Depends(get_db)
-):
-    """提交问题"""
-    image_base64 = None
-    image_url = None
-    
-    if image and image.filename:
-        # 读取图片并转base64
-        image_data = await image.read()
-        image_base64 = base64.b64encode(image_data).decode()
-        # 保存图片
-        os.makedirs("static/uploads", exist_ok=True)
-        image_path = f"static/uploads/{datetime.now().strftime('%Y%m%d%H%M%S')}_{image.filename}"
-        with open(image_path, "wb") as f:
-            f.write(image_data)
-        image_url = "/" + image_path
-    
-    # 调用LLM解答
-    result = llm_service.solve_math_question(content, image_base64)
-    
-    if "error" in result:
-        raise HTTPException(status_code=500, detail=result["error"])
+def _sse(event: str, data) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _save_upload(image: UploadFile):
+    """预处理并保存上传的题目图片，返回 (base64编码, 访问URL, 缩略图URL)"""
+    if not image or not image.filename:
+        return None, None, None
     
-    # 保存到数据库
+    processed, image_url, thumbnail_url = await image_service.save_upload(image)
+    return base64.b64encode(processed).decode(), image_url, thumbnail_url
+
+
+async def _save_solution(db: AsyncSession, user_id: int, content: str, subject: str, image_url: str, thumbnail_url: str, result: dict) -> Question:
+    """保存题目及解答，并更新学习统计（同一事务）"""
+    await stats_service.record_question(db, user_id)
     question = Question(
-        user_id=int(user["sub"]),
+        user_id=user_id,
         content=content,
         image_url=image_url,
+        thumbnail_url=thumbnail_url,
         subject=subject,
         knowledge_point=",".join(result.get("knowledge_points", []))
     )
+    await knowledge_service.link_question(db, question, result.get("knowledge_points", []))
     db.add(question)
-    db.commit()
-    db.refresh(question)
+    await db.flush()
     
     # 保存答案
     answer = Answer(
@@ -269,7 +349,38 @@ async def submit_question(
         steps=json.dumps(result.get("steps", []), ensure_ascii=False)
     )
     db.add(answer)
-    db.commit()
+    await db.commit()
+    
+    return question
+
+
+@app.post("/api/question")
+async def submit_question(
+    request: Request,
+    content: str = Form(""),
+    subject: str = Form("数学"),
+    image: UploadFile = File(None),
+    user=Depends(require_auth),
+    db: AsyncSession = Depends(get_db)
+):
+    """提交问题"""
+    image_base64, image_url, thumbnail_url = await _save_upload(image)
+    
+    # 相同题目优先使用缓存的解答
+    cache_key = answer_cache.make_key(content, subject, image_base64)
+    result = await answer_cache.get(cache_key)
+    if result is None:
+        # 调用LLM解答
+        result = await llm_service.solve_math_question(content, image_base64)
+        
+        if "error" in result:
+            raise HTTPException(status_code=500, detail=result["error"])
+        # 未能解析的原文结果不缓存，下次重新解答
+        if result.get("parsed", True):
+            await answer_cache.set(cache_key, result)
+    
+    # 保存到数据库
+    question = await _save_solution(db, int(user["sub"]), content, subject, image_url, thumbnail_url, result)
     
     return {
         "question_id": question.id,
@@ -280,96 +391,326 @@ async def submit_question(
     }
 
 
+@app.post("/api/question/stream")
+async def submit_question_stream(
+    request: Request,
+    content: str = Form(""),
+    subject: str = Form("数学"),
+    image: UploadFile = File(None),
+    user=Depends(require_auth)
+):
+    """提交问题（SSE流式返回答案、每个步骤、知识点）"""
+    image_base64, image_url, thumbnail_url = await _save_upload(image)
+    user_id = int(user["sub"])
+    
+    cache_key = answer_cache.make_key(content, subject, image_base64)
+    cached = await answer_cache.get(cache_key)
+    if cached is None:
+        # 开始推送后无法再返回错误状态码，熔断中或排队已满时提前拒绝
+        llm_service.check_available("interactive")
+    
+    async def solution_events():
+        if cached is not None:
+            yield "result", cached
+            return
+        async for event, data in llm_service.solve_math_question_stream(content, image_base64):
+            if event == "result" and data.get("parsed", True):
+                await answer_cache.set(cache_key, data)
+            yield event, data
+    
+    async def event_stream():
+        sent = set()
+        step_index = 0
+        async for event, data in solution_events():
+            if event == "step":
+                yield _sse("step", {"index": step_index, "content": data})
+                step_index += 1
+                sent.add("steps")
+            elif event == "result":
+                # 补发未能增量解析出的部分，再保存完整结果
+                if "answer" not in sent:
+                    yield _sse("answer", data.get("answer", ""))
+                if "steps" not in sent:
+                    for i, step in enumerate(data.get("steps", [])):
+                        yield _sse("step", {"index": i, "content": step})
+                for key in ("knowledge_points", "tips"):
+                    if key not in sent:
+                        yield _sse(key, data.get(key, [] if key == "knowledge_points" else ""))
+                async with AsyncSessionLocal() as stream_db:
+                    question = await _save_solution(stream_db, user_id, content, subject, image_url, thumbnail_url, data)
+                    question_id = question.id
+                yield _sse("done", {"question_id": question_id})
+            else:
+                yield _sse(event, data)
+                sent.add(event)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/api/cache/stats")
+async def get_cache_stats(user=Depends(require_auth)):
+    """获取解答缓存命中统计（coalesced 为合并到进行中调用的解题请求数）"""
+    return {**answer_cache.stats(), "coalesced": llm_service.coalesced}
+
+
+@app.get("/api/llm/stats")
+async def get_llm_stats(user=Depends(require_auth)):
+    """获取LLM调用指标"""
+    return {
+        **llm_scheduler.stats(),
+        "upstream": llm_service.resilience_stats(),
+        "structured_output": llm_service.structured_output_stats()
+    }
+
+
 @app.post("/api/essay")
 async def submit_essay(
     title: str = Form(...),
     content: str = Form(...),
     essay_type: str = Form("记叙文"),
     user=Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """提交作文批改"""
-    # 调用LLM批改
-    result = llm_service.review_essay(title, content, essay_type)
-    
-    if "error" in result:
-        raise HTTPException(status_code=500, detail=result["error"])
-    
-    # 保存到数据库
-    essay = Essay(
-        user_id=int(user["sub"]),
-        title=title,
-        content=content,
-        essay_type=essay_type,
-        overall_score=result.get("overall_score", 0),
-        structure_feedback=json.dumps(result.get("structure", {}), ensure_ascii=False),
-        grammar_feedback=json.dumps(result.get("grammar", {}), ensure_ascii=False),
-        vocabulary_feedback=json.dumps(result.get("vocabulary", {}), ensure_ascii=False),
-        suggestions=json.dumps(result.get("suggestions", []), ensure_ascii=False),
-        topic_analysis=json.dumps(result.get("topic_analysis", {}), ensure_ascii=False)
+    """提交作文批改（加入后台队列，返回任务ID）"""
+    job = await essay_queue.submit(db, int(user["sub"]), title, content, essay_type)
+    return {"job_id": job.id, "status": job.status}
+
+
+async def _read_batch_essays(request: Request) -> list:
+    """读取批量作文：NDJSON每行一篇，或multipart上传多个文本文件（文件名作为标题）"""
+    essays = []
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        essay_type = form.get("essay_type") or "记叙文"
+        for upload in form.getlist("files"):
+            text = (await upload.read()).decode("utf-8-sig")
+            if not text.strip():
+                raise HTTPException(status_code=400, detail=f"文件 {upload.filename} 没有作文内容")
+            essays.append({
+                "title": os.path.splitext(upload.filename or "")[0],
+                "content": text,
+                "essay_type": essay_type
+            })
+    else:
+        body = (await request.body()).decode("utf-8")
+        for number, line in enumerate(body.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"第{number}行NDJSON格式错误")
+            if not isinstance(item, dict):
+                raise HTTPException(status_code=400, detail=f"第{number}行应为JSON对象")
+            content = item.get("content")
+            if not isinstance(content, str) or not content.strip():
+                raise HTTPException(status_code=400, detail=f"第{number}行没有作文内容")
+            essays.append({
+                "title": item.get("title", ""),
+                "content": content,
+                "essay_type": item.get("essay_type") or "记叙文"
+            })
+    return essays
+
+
+@app.post("/api/essay/batch")
+async def submit_essay_batch(
+    request: Request,
+    parallelism: int = ESSAY_BATCH_PARALLELISM,
+    user=Depends(require_auth)
+):
+    """批量批改作文，按完成顺序以NDJSON逐篇返回结果，结束时（包括客户端中途断开）一次性写入数据库"""
+    essays = await _read_batch_essays(request)
+    if not essays:
+        raise HTTPException(status_code=400, detail="没有可批改的作文")
+    if len(essays) > ESSAY_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"单次最多批改{ESSAY_BATCH_MAX}篇")
+    user_id = int(user["sub"])
+    parallelism = min(max(parallelism, 1), ESSAY_BATCH_PARALLELISM)
+    
+    async def result_stream():
+        completed = {}
+        try:
+            async for index, result in essay_service.review_batch(essays, parallelism, completed):
+                essay = essays[index]
+                if "error" in result:
+                    line = {"index": index, "title": essay["title"], "status": "failed", "error": result["error"]}
+                else:
+                    line = {"index": index, "title": essay["title"], "status": "done", "result": result}
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        finally:
+            # 在一个事务中批量写入；客户端中途断开时也保存已完成的批改
+            essay_ids = await essay_service.save_batch(user_id, essays, completed)
+        
+        yield json.dumps({
+            "status": "saved",
+            "total": len(essays),
+            "saved": len(essay_ids),
+            "essay_ids": essay_ids
+        }, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+
+async def _get_essay_job(db: AsyncSession, job_id: int, user: dict) -> EssayJob:
+    job = await db.scalar(select(EssayJob).where(
+        EssayJob.id == job_id,
+        EssayJob.user_id == int(user["sub"])
+    ))
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@app.get("/api/essay/jobs")
+async def get_essay_jobs(user=Depends(require_auth), db: AsyncSession = Depends(get_db)):
+    """获取最近的批改任务"""
+    jobs = await db.scalars(select(EssayJob).where(
+        EssayJob.user_id == int(user["sub"])
+    ).order_by(EssayJob.created_at.desc()).limit(50))
+    
+    return [essay_service.job_to_dict(job) for job in jobs]
+
+
+@app.get("/api/essay/jobs/{job_id}")
+async def get_essay_job(job_id: int, user=Depends(require_auth), db: AsyncSession = Depends(get_db)):
+    """查询批改任务状态，完成后包含批改结果"""
+    return essay_service.job_to_dict(await _get_essay_job(db, job_id, user))
+
+
+@app.get("/api/essay/jobs/{job_id}/events")
+async def essay_job_events(job_id: int, user=Depends(require_auth), db: AsyncSession = Depends(get_db)):
+    """批改任务状态（SSE推送，完成或失败后结束）"""
+    await _get_essay_job(db, job_id, user)
+    
+    async def event_stream():
+        last_status = None
+        while True:
+            async with AsyncSessionLocal() as poll_db:
+                job = essay_service.job_to_dict(await poll_db.get(EssayJob, job_id))
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield _sse("status", job)
+            if job["status"] in ("done", "failed"):
+                break
+            await asyncio.sleep(1)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
-    db.add(essay)
-    db.commit()
+
+
+async def _prepare_chat(db: AsyncSession, user: dict, message: str, session_id: int = None):
+    """获取会话历史并组装发送给LLM的消息（本轮消息在回复后与回复一起写入）"""
+    history = None
+    if session_id:
+        history = await chat_context.load_history(db, session_id, int(user["sub"]))
+        if history is None:
+            raise HTTPException(status_code=404, detail="会话不存在")
     
-    return result
+    recent = (history["messages"] if history else []) + [{"role": "user", "content": message}]
+    messages = chat_context.build_messages(history["summary"] if history else None, recent)
+    return messages
+
+
+async def _finish_chat(db: AsyncSession, user: dict, session_id: int, message: str, response: str):
+    """保存本轮对话（一个事务），返回 (会话ID, 是否需要刷新摘要)"""
+    session_id = await chat_context.save_turn(db, int(user["sub"]), session_id, message, response)
+    history = chat_context.history_cache.get(session_id)
+    return session_id, bool(history) and chat_context.needs_summary(history["messages"])
 
 
 @app.post("/api/chat")
 async def chat(
     request: Request,
+    background_tasks: BackgroundTasks,
     user=Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """聊天"""
     data = await request.json()
     message = data.get("message", "")
     session_id = data.get("session_id")
-    
-    # 获取或创建会话
-    if session_id:
-        session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-    else:
-        session = ChatSession(user_id=int(user["sub"]), title=message[:20])
-        db.add(session)
-        db.commit()
-        db.refresh(session)
-    
-    # 保存用户消息
-    user_msg = ChatMessage(session_id=session.id, role="user", content=message)
-    db.add(user_msg)
-    db.commit()
-    
-    # 获取历史消息
-    history = db.query(ChatMessage).filter(ChatMessage.session_id == session.id).order_by(ChatMessage.created_at).all()
-    messages = [{"role": m.role, "content": m.content} for m in history]
+    messages = await _prepare_chat(db, user, message, session_id)
     
     # 调用LLM
-    response = llm_service.chat(messages)
+    response = await llm_service.chat(messages)
     
-    # 保存助手回复
-    assistant_msg = ChatMessage(session_id=session.id, role="assistant", content=response)
-    db.add(assistant_msg)
-    db.commit()
+    # 保存用户消息和助手回复
+    session_id, refresh = await _finish_chat(db, user, session_id, message, response)
     
-    return {"session_id": session.id, "response": response}
+    # 回复返回后在后台刷新摘要
+    if refresh:
+        background_tasks.add_task(chat_context.refresh_summary, session_id)
+    
+    return {"session_id": session_id, "response": response}
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(
+    request: Request,
+    user=Depends(require_auth),
+    db: AsyncSession = Depends(get_db)
+):
+    """聊天（SSE流式返回）"""
+    data = await request.json()
+    message = data.get("message", "")
+    session_id = data.get("session_id")
+    messages = await _prepare_chat(db, user, message, session_id)
+    llm_service.check_available("interactive")
+    saved = {}
+    
+    async def event_stream():
+        if session_id:
+            yield _sse("session", {"session_id": session_id})
+        
+        parts = []
+        async for delta in llm_service.chat_stream(messages):
+            parts.append(delta)
+            yield _sse("delta", {"content": delta})
+        
+        # 流结束后保存本轮对话（依赖注入的会话此时已关闭）
+        async with AsyncSessionLocal() as stream_db:
+            saved_id, refresh = await _finish_chat(stream_db, user, session_id, message, "".join(parts))
+        
+        saved.update(session_id=saved_id, refresh=refresh)
+        yield _sse("done", {"session_id": saved_id})
+    
+    async def refresh_after_response():
+        # 响应发送完后再刷新摘要
+        if saved.get("refresh"):
+            await chat_context.refresh_summary(saved["session_id"])
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(refresh_after_response)
+    )
 
 
 @app.get("/api/chat/sessions")
-async def get_chat_sessions(user=Depends(require_auth), db: Session = Depends(get_db)):
+async def get_chat_sessions(user=Depends(require_auth), db: AsyncSession = Depends(get_db)):
     """获取聊天会话列表"""
-    sessions = db.query(ChatSession).filter(
+    sessions = await db.scalars(select(ChatSession).where(
         ChatSession.user_id == int(user["sub"])
-    ).order_by(ChatSession.created_at.desc()).limit(20).all()
+    ).order_by(ChatSession.created_at.desc()).limit(20))
     
     return [{"id": s.id, "title": s.title, "created_at": s.created_at.isoformat()} for s in sessions]
 
 
 @app.get("/api/chat/messages/{session_id}")
-async def get_chat_messages(session_id: int, user=Depends(require_auth), db: Session = Depends(get_db)):
+async def get_chat_messages(session_id: int, user=Depends(require_auth), db: AsyncSession = Depends(get_db)):
     """获取聊天消息"""
-    messages = db.query(ChatMessage).filter(
+    messages = await db.scalars(select(ChatMessage).where(
         ChatMessage.session_id == session_id
-    ).order_by(ChatMessage.created_at).all()
+    ).order_by(ChatMessage.created_at))
     
     return [{"role": m.role, "content": m.content, "created_at": m.created_at.isoformat()} for m in messages]
 
@@ -378,7 +719,7 @@ async def get_chat_messages(session_id: int, user=Depends(require_auth), db: Ses
 async def add_to_wrong_book(
     request: Request,
     user=Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """添加到错题本"""
     data = await request.json()
@@ -386,48 +727,56 @@ async def add_to_wrong_book(
     error_reason = data.get("error_reason", "")
     
     # 检查是否已存在
-    existing = db.query(WrongQuestion).filter(
+    existing = await db.scalar(select(WrongQuestion).where(
         WrongQuestion.user_id == int(user["sub"]),
         WrongQuestion.question_id == question_id
-    ).first()
+    ))
     
     if existing:
         return {"message": "已在错题本中"}
     
+    question = await db.get(Question, question_id)
+    await stats_service.record_wrong(db, int(user["sub"]), question.knowledge_point if question else None)
     wrong = WrongQuestion(
         user_id=int(user["sub"]),
         question_id=question_id,
         error_reason=error_reason
     )
     db.add(wrong)
-    db.commit()
+    await db.commit()
     
     return {"message": "已添加到错题本"}
 
 
 @app.get("/api/wrong-book")
-async def get_wrong_book(user=Depends(require_auth), db: Session = Depends(get_db), include_mastered: bool = False):
-    """获取错题本"""
-    if include_mastered:
-        wrongs = db.query(WrongQuestion).filter(
-            WrongQuestion.user_id == int(user["sub"])
-        ).order_by(WrongQuestion.created_at.desc()).all()
-    else:
-        wrongs = db.query(WrongQuestion).filter(
-            WrongQuestion.user_id == int(user["sub"]),
-            WrongQuestion.is_mastered == False
-        ).order_by(WrongQuestion.created_at.desc()).all()
+async def get_wrong_book(
+    user=Depends(require_auth),
+    db: AsyncSession = Depends(get_db),
+    include_mastered: bool = False,
+    knowledge_point: str = None
+):
+    """获取错题本，可按知识点筛选"""
+    # 一次查询连带加载题目和答案
+    query = select(WrongQuestion).options(
+        joinedload(WrongQuestion.question).joinedload(Question.answer)
+    ).where(WrongQuestion.user_id == int(user["sub"]))
+    if not include_mastered:
+        query = query.where(WrongQuestion.is_mastered == False)
+    if knowledge_point:
+        query = query.where(WrongQuestion.question_id.in_(knowledge_service.question_ids_with_point(knowledge_point)))
+    wrongs = await db.scalars(query.order_by(WrongQuestion.created_at.desc()))
     
     result = []
     for w in wrongs:
-        q = db.query(Question).filter(Question.id == w.question_id).first()
-        a = db.query(Answer).filter(Answer.question_id == w.question_id).first()
+        q = w.question
+        a = q.answer if q else None
         if q:
             result.append({
                 "id": w.id,
                 "question_id": w.question_id,
                 "content": q.content,
                 "image_url": q.image_url,
+                "thumbnail_url": q.thumbnail_url or q.image_url,
                 "subject": q.subject,
                 "answer": a.content if a else "",
                 "steps": json.loads(a.steps) if a and a.steps else [],
@@ -440,53 +789,58 @@ async def get_wrong_book(user=Depends(require_auth), db: Session = Depends(get_d
 
 
 @app.post("/api/wrong-book/practice/{wrong_id}")
-async def practice_wrong(wrong_id: int, user=Depends(require_auth), db: Session = Depends(get_db)):
+async def practice_wrong(wrong_id: int, user=Depends(require_auth), db: AsyncSession = Depends(get_db)):
     """练习错题"""
-    wrong = db.query(WrongQuestion).filter(
+    wrong = await db.scalar(select(WrongQuestion).where(
         WrongQuestion.id == wrong_id,
         WrongQuestion.user_id == int(user["sub"])
-    ).first()
+    ))
     
     if wrong:
         wrong.practice_count += 1
-        db.commit()
+        await db.commit()
     
     return {"message": "已记录练习"}
 
 
 @app.post("/api/wrong-book/master/{wrong_id}")
-async def master_wrong(wrong_id: int, user=Depends(require_auth), db: Session = Depends(get_db)):
+async def master_wrong(wrong_id: int, user=Depends(require_auth), db: AsyncSession = Depends(get_db)):
     """标记为已掌握"""
-    wrong = db.query(WrongQuestion).filter(
+    wrong = await db.scalar(select(WrongQuestion).options(joinedload(WrongQuestion.question)).where(
         WrongQuestion.id == wrong_id,
         WrongQuestion.user_id == int(user["sub"])
-    ).first()
+    ))
     
-    if wrong:
+    if wrong and not wrong.is_mastered:
+        knowledge_point = wrong.question.knowledge_point if wrong.question else None
+        await stats_service.record_mastered(db, int(user["sub"]), knowledge_point)
         wrong.is_mastered = True
-        db.commit()
+        await db.commit()
     
     return {"message": "已标记为掌握"}
 
 
 @app.get("/api/wrong-book/mastered")
-async def get_mastered_questions(user=Depends(require_auth), db: Session = Depends(get_db)):
+async def get_mastered_questions(user=Depends(require_auth), db: AsyncSession = Depends(get_db)):
     """获取已掌握的题目"""
-    wrongs = db.query(WrongQuestion).filter(
+    wrongs = await db.scalars(select(WrongQuestion).options(
+        joinedload(WrongQuestion.question).joinedload(Question.answer)
+    ).where(
         WrongQuestion.user_id == int(user["sub"]),
         WrongQuestion.is_mastered == True
-    ).order_by(WrongQuestion.created_at.desc()).all()
+    ).order_by(WrongQuestion.created_at.desc()))
     
     result = []
     for w in wrongs:
-        q = db.query(Question).filter(Question.id == w.question_id).first()
-        a = db.query(Answer).filter(Answer.question_id == w.question_id).first()
+        q = w.question
+        a = q.answer if q else None
         if q:
             result.append({
                 "id": w.id,
                 "question_id": q.id,
                 "content": q.content,
                 "image_url": q.image_url,
+                "thumbnail_url": q.thumbnail_url or q.image_url,
                 "subject": q.subject,
                 "knowledge_point": q.knowledge_point,
                 "answer": a.content if a else "",
@@ -499,104 +853,48 @@ async def get_mastered_questions(user=Depends(require_auth), db: Session = Depen
 
 
 @app.get("/api/statistics")
-async def get_statistics(user=Depends(require_auth), db: Session = Depends(get_db)):
-    """获取学习统计"""
-    user_id = int(user["sub"])
-    
-    # 总题目数
-    total_questions = db.query(Question).filter(Question.user_id == user_id).count()
-    
-    # 错题数
-    wrong_count = db.query(WrongQuestion).filter(
-        WrongQuestion.user_id == user_id,
-        WrongQuestion.is_mastered == False
-    ).count()
-    
-    # 已掌握数
-    mastered_count = db.query(WrongQuestion).filter(
-        WrongQuestion.user_id == user_id,
-        WrongQuestion.is_mastered == True
-    ).count()
-    
-    # 作文数
-    essay_count = db.query(Essay).filter(Essay.user_id == user_id).count()
-    
-    # 平均作文分数
-    avg_score = db.query(func.avg(Essay.overall_score)).filter(
-        Essay.user_id == user_id
-    ).scalar() or 0
-    
-    # 薄弱知识点（从错题中统计）
-    wrongs = db.query(WrongQuestion).filter(
-        WrongQuestion.user_id == user_id,
-        WrongQuestion.is_mastered == False
-    ).all()
-    
-    knowledge_points = {}
-    for w in wrongs:
-        q = db.query(Question).filter(Question.id == w.question_id).first()
-        if q and q.knowledge_point:
-            for kp in q.knowledge_point.split(","):
-                kp = kp.strip()
-                if kp:
-                    knowledge_points[kp] = knowledge_points.get(kp, 0) + 1
-    
-    weak_points = sorted(knowledge_points.items(), key=lambda x: -x[1])[:5]
-    
-    # 最近7天的题目数
-    from datetime import timedelta
-    week_ago = datetime.now() - timedelta(days=7)
-    recent_questions = db.query(Question).filter(
-        Question.user_id == user_id,
-        Question.created_at >= week_ago
-    ).count()
-    
-    return {
-        "total_questions": total_questions,
-        "wrong_count": wrong_count,
-        "mastered_count": mastered_count,
-        "essay_count": essay_count,
-        "avg_essay_score": round(avg_score, 1),
-        "weak_points": [{"name": wp[0], "count": wp[1]} for wp in weak_points],
-        "recent_questions": recent_questions,
-        "accuracy_rate": round((1 - wrong_count / max(total_questions, 1)) * 100, 1)
-    }
+async def get_statistics(user=Depends(require_auth), db: AsyncSession = Depends(get_db)):
+    """获取学习统计（读取汇总表）"""
+    stats = await stats_service.get_user_stats(db, int(user["sub"]))
+    result = stats_service.summarize(stats)
+    # 老用户首次访问时会回填汇总行
+    await db.commit()
+    return result
 
 
 @app.get("/api/recommend")
-async def get_recommendations(user=Depends(require_auth), db: Session = Depends(get_db)):
-    """获取推荐练习"""
+async def get_recommendations(difficulty: int = None, user=Depends(require_auth), db: AsyncSession = Depends(get_db)):
+    """获取推荐练习，优先使用题库，不足时由LLM生成"""
     user_id = int(user["sub"])
     
-    # 获取薄弱知识点
-    wrongs = db.query(WrongQuestion).filter(
-        WrongQuestion.user_id == user_id,
-        WrongQuestion.is_mastered == False
-    ).all()
-    
-    knowledge_points = set()
-    subject = "数学"
-    for w in wrongs:
-        q = db.query(Question).filter(Question.id == w.question_id).first()
-        if q:
-            subject = q.subject or "数学"
-            if q.knowledge_point:
-                for kp in q.knowledge_point.split(","):
-                    knowledge_points.add(kp.strip())
+    # 获取薄弱知识点（按错题数排序）
+    knowledge_points = [name for name, _ in await knowledge_service.weak_points(db, user_id, limit=3)]
+    subject = await knowledge_service.weak_subject(db, user_id) or "数学"
     
     if not knowledge_points:
         knowledge_points = ["基础运算"]
     
-    # 调用LLM生成推荐题目
-    exercises = llm_service.recommend_exercises(list(knowledge_points)[:3], subject)
+    # 先从题库取题
+    exercises = [
+        exercise_service.to_dict(e)
+        for e in await exercise_service.pick_exercises(db, subject, knowledge_points, RECOMMEND_COUNT, difficulty)
+    ]
+    
+    # 题库不足时调用LLM生成推荐题目，并存入题库
+    missing = RECOMMEND_COUNT - len(exercises)
+    if missing > 0:
+        generated = await llm_service.recommend_exercises(knowledge_points, subject, count=missing, difficulty=difficulty)
+        saved = exercise_service.save_exercises(db, subject, generated, knowledge_points)
+        await db.commit()
+        exercises.extend(exercise_service.to_dict(e) for e in saved[:missing])
     
     return exercises
 
 
 @app.get("/api/profile")
-async def get_profile(user=Depends(require_auth), db: Session = Depends(get_db)):
+async def get_profile(user=Depends(require_auth), db: AsyncSession = Depends(get_db)):
     """获取用户信息"""
-    db_user = db.query(User).filter(User.id == int(user["sub"])).first()
+    db_user = await db.get(User, int(user["sub"]))
     if not db_user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
@@ -616,17 +914,17 @@ async def update_profile(
     grade: str = Form(""),
     subjects: str = Form(""),
     user=Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """更新用户信息"""
-    db_user = db.query(User).filter(User.id == int(user["sub"])).first()
+    db_user = await db.get(User, int(user["sub"]))
     if not db_user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
     db_user.email = email
     db_user.grade = grade
     db_user.subjects = subjects
-    db.commit()
+    await db.commit()
     
     return {"message": "更新成功"}
 
@@ -636,29 +934,30 @@ async def get_history(
     page: int = 1,
     limit: int = 10,
     user=Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """获取学习历史"""
     user_id = int(user["sub"])
     offset = (page - 1) * limit
     
-    questions = db.query(Question).filter(
+    questions = await db.scalars(select(Question).options(joinedload(Question.answer)).where(
         Question.user_id == user_id
-    ).order_by(Question.created_at.desc()).offset(offset).limit(limit).all()
+    ).order_by(Question.created_at.desc()).offset(offset).limit(limit))
     
     result = []
     for q in questions:
-        a = db.query(Answer).filter(Answer.question_id == q.id).first()
+        a = q.answer
         result.append({
             "id": q.id,
             "content": q.content,
             "image_url": q.image_url,
+            "thumbnail_url": q.thumbnail_url or q.image_url,
             "subject": q.subject,
             "answer": a.content if a else "",
             "created_at": q.created_at.isoformat()
         })
     
-    total = db.query(Question).filter(Question.user_id == user_id).count()
+    total = await db.scalar(select(func.count(Question.id)).where(Question.user_id == user_id))
     
     return {"items": result, "total": total, "page": page, "limit": limit}
 
@@ -0,0 +1,188 @@
+"""数据库迁移 - 按顺序执行尚未应用的迁移，SQLite 和 PostgreSQL 通用
+
+用法：
+    python migrate.py           # 执行所有未应用的迁移
+    python migrate.py --list    # 查看各迁移的状态
+
+连接 DATABASE_URL 指定的数据库。先按模型创建缺少的表，再逐个执行迁移（每个迁移一个事务），
+已应用的迁移记录在 schema_migrations 表中。每个迁移都会先检查现有表结构，
+对以前用单独的 migrate_*.py 脚本迁移过的数据库执行也是安全的。
+"""
+import argparse
+import sys
+import os
+from datetime import datetime
+from sqlalchemy import inspect, text, select, Table, Column, String, DateTime, MetaData
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from models.database import engine, init_db, Question, KnowledgePoint, question_knowledge_points
+from services.stats_service import split_knowledge_points
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("id", String(100), primary_key=True),
+    Column("applied_at", DateTime, nullable=False)
+)
+
+
+def _add_columns(conn, table: str, columns: list):
+    """添加缺少的字段，columns 为 [(字段名, 类型)]"""
+    existing = {column["name"] for column in inspect(conn).get_columns(table)}
+    for name, column_type in columns:
+        if name not in existing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}"))
+            print(f"   ✅ {table}.{name} 字段添加成功")
+
+
+def _add_indexes(conn, indexes: list):
+    """添加缺少的索引，indexes 为 [(索引名, 表名, 字段)]"""
+    inspector = inspect(conn)
+    for name, table, columns in indexes:
+        existing = {index["name"] for index in inspector.get_indexes(table)}
+        if name not in existing:
+            conn.execute(text(f"CREATE INDEX {name} ON {table} ({columns})"))
+            print(f"   ✅ 索引 {name} 添加成功")
+
+
+def essay_topic_analysis(conn):
+    _add_columns(conn, "essays", [("topic_analysis", "TEXT")])
+
+
+def composite_indexes(conn):
+    _add_indexes(conn, [
+        ("ix_questions_user_id_created_at", "questions", "user_id, created_at"),
+        ("ix_wrong_questions_user_id_is_mastered_created_at", "wrong_questions", "user_id, is_mastered, created_at"),
+        ("ix_wrong_questions_user_id_question_id", "wrong_questions", "user_id, question_id"),
+        ("ix_answers_question_id", "answers", "question_id"),
+        ("ix_chat_messages_session_id_created_at", "chat_messages", "session_id, created_at"),
+        ("ix_essays_user_id", "essays", "user_id"),
+        ("ix_chat_sessions_user_id_created_at", "chat_sessions", "user_id, created_at"),
+    ])
+
+
+def knowledge_points(conn):
+    """从 questions.knowledge_point 回填知识点维表和关联表（表本身由 init_db 创建）"""
+    _add_indexes(conn, [
+        ("ix_question_knowledge_points_knowledge_point_id", "question_knowledge_points", "knowledge_point_id, question_id"),
+    ])
+    point_ids = {name: kp_id for kp_id, name in conn.execute(select(KnowledgePoint.id, KnowledgePoint.name))}
+    linked = set(conn.execute(select(
+        question_knowledge_points.c.question_id, question_knowledge_points.c.knowledge_point_id
+    )))
+    rows = conn.execute(select(Question.id, Question.knowledge_point).where(
+        Question.knowledge_point.isnot(None), Question.knowledge_point != ""
+    )).all()
+
+    added = 0
+    for question_id, knowledge_point in rows:
+        for name in dict.fromkeys(split_knowledge_points(knowledge_point)):
+            if name not in point_ids:
+                point_ids[name] = conn.execute(
+                    KnowledgePoint.__table__.insert().values(name=name, created_at=datetime.now())
+                ).inserted_primary_key[0]
+            if (question_id, point_ids[name]) not in linked:
+                conn.execute(question_knowledge_points.insert().values(
+                    question_id=question_id, knowledge_point_id=point_ids[name]
+                ))
+                linked.add((question_id, point_ids[name]))
+                added += 1
+    print(f"   ✅ 处理 {len(rows)} 道题目，新增 {added} 条知识点关联")
+
+
+def exercise_bank(conn):
+    _add_columns(conn, "exercises", [
+        ("options", "TEXT"),
+        ("source", "VARCHAR(20) DEFAULT 'llm'"),
+        ("created_at", "TIMESTAMP"),
+    ])
+    # 已有题目视为导入题目，长期有效
+    conn.execute(text("UPDATE exercises SET source = 'import' WHERE created_at IS NULL"))
+    conn.execute(text("UPDATE exercises SET created_at = :now WHERE created_at IS NULL"), {"now": datetime.now()})
+    _add_indexes(conn, [
+        ("ix_exercises_subject_knowledge_point_difficulty", "exercises", "subject, knowledge_point, difficulty"),
+    ])
+
+
+def chat_summary(conn):
+    _add_columns(conn, "chat_sessions", [("summary", "TEXT"), ("summary_until", "INTEGER DEFAULT 0")])
+
+
+def question_thumbnail(conn):
+    _add_columns(conn, "questions", [("thumbnail_url", "VARCHAR(500)")])
+
+
+def widen_knowledge_points(conn):
+    """知识点字段改为TEXT：模型返回的多个知识点拼接后可能超过100个字符（SQLite不限制长度，无需修改）"""
+    if conn.dialect.name != "postgresql":
+        return
+    for table in ("questions", "exercises"):
+        conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN knowledge_point TYPE TEXT"))
+    conn.execute(text("ALTER TABLE knowledge_points ALTER COLUMN name TYPE TEXT"))
+    print("   ✅ 知识点字段已改为TEXT")
+
+
+# (迁移ID, 说明, 执行函数)，按顺序执行，已发布的迁移不要修改或调整顺序
+MIGRATIONS = [
+    ("0001_essay_topic_analysis", "作文表添加主题分析字段", essay_topic_analysis),
+    ("0002_composite_indexes", "按用户、按时间查询的复合索引", composite_indexes),
+    ("0003_knowledge_points", "知识点维表回填", knowledge_points),
+    ("0004_exercise_bank", "练习题库字段和索引", exercise_bank),
+    ("0005_chat_summary", "聊天会话滚动摘要字段", chat_summary),
+    ("0006_question_thumbnail", "题目缩略图字段", question_thumbnail),
+    ("0007_widen_knowledge_points", "知识点字段不限长度", widen_knowledge_points),
+]
+
+
+def applied_migrations() -> set:
+    schema_migrations.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(select(schema_migrations.c.id))}
+
+
+def migrate():
+    """执行迁移"""
+    print(f"数据库: {engine.url.render_as_string(hide_password=True)}")
+    init_db()
+    applied = applied_migrations()
+
+    pending = [m for m in MIGRATIONS if m[0] not in applied]
+    if not pending:
+        print("ℹ️ 所有迁移均已应用，无需迁移")
+        return
+
+    for migration_id, description, run in pending:
+        print(f"正在执行 {migration_id}（{description}）...")
+        try:
+            with engine.begin() as conn:
+                run(conn)
+                conn.execute(schema_migrations.insert().values(id=migration_id, applied_at=datetime.now()))
+        except Exception as e:
+            print(f"❌ 迁移 {migration_id} 失败: {str(e)}")
+            sys.exit(1)
+        print(f"✅ {migration_id} 完成")
+
+    # 更新查询优化器的统计信息
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+
+def show():
+    """列出各迁移的状态"""
+    applied = applied_migrations()
+    for migration_id, description, _ in MIGRATIONS:
+        mark = "✅" if migration_id in applied else "⏳"
+        print(f"{mark} {migration_id}  {description}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="数据库迁移")
+    parser.add_argument("--list", action="store_true", help="查看迁移状态")
+    args = parser.parse_args()
+
+    if args.list:
+        show()
+    else:
+        print("开始数据库迁移...")
+        migrate()
+        print("迁移完成！")
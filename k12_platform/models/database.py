@@ -1,15 +1,88 @@
 """数据库模型定义"""
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey
+from sqlalchemy import create_engine, event, Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey, Index, Table
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from datetime import datetime
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import DATABASE_URL
+from config import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_CONNECT_TIMEOUT,
+    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT_MS, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE_KB
+)
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+
+def _async_url(url: str) -> str:
+    """把同步驱动的数据库URL换成对应的异步驱动（SQLite用aiosqlite，PostgreSQL用asyncpg）"""
+    scheme, rest = url.split(":", 1)
+    if scheme == "sqlite":
+        return "sqlite+aiosqlite:" + rest
+    if scheme in ("postgresql", "postgres", "postgresql+psycopg2"):
+        return "postgresql+asyncpg:" + rest
+    return url
+
+
+def _sync_url(url: str) -> str:
+    """SQLAlchemy 2.0 不再识别 postgres:// 简写"""
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def _connect_args(async_driver: bool) -> dict:
+    """各数据库驱动的连接参数"""
+    if IS_SQLITE:
+        args = {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        if not async_driver:
+            args["check_same_thread"] = False
+        return args
+    # asyncpg 和 psycopg2 的连接超时参数名不同
+    return {"timeout": DB_CONNECT_TIMEOUT} if async_driver else {"connect_timeout": DB_CONNECT_TIMEOUT}
+
+
+POOL_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+# 同步引擎：建表、迁移和命令行脚本使用
+engine = create_engine(_sync_url(DATABASE_URL), connect_args=_connect_args(False), **POOL_OPTIONS)
+
+# 异步引擎：API路由和后台任务使用，数据库I/O不阻塞事件循环
+async_engine = create_async_engine(
+    _async_url(DATABASE_URL),
+    connect_args=_connect_args(True),
+    poolclass=AsyncAdaptedQueuePool,
+    **POOL_OPTIONS
+)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """每个新连接应用SQLite性能设置"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.close()
+
+
+if IS_SQLITE:
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 提交后不过期对象，避免在异步会话中隐式重新加载属性
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 
@@ -33,26 +106,56 @@ class User(Base):
     chat_sessions = relationship("ChatSession", back_populates="user")
 
 
+# 题目-知识点关联表
+question_knowledge_points = Table(
+    "question_knowledge_points",
+    Base.metadata,
+    Column("question_id", Integer, ForeignKey("questions.id"), primary_key=True),
+    Column("knowledge_point_id", Integer, ForeignKey("knowledge_points.id"), primary_key=True),
+    Index("ix_question_knowledge_points_knowledge_point_id", "knowledge_point_id", "question_id")
+)
+
+
+class KnowledgePoint(Base):
+    """知识点表"""
+    __tablename__ = "knowledge_points"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(Text, unique=True, index=True)
+    created_at = Column(DateTime, default=datetime.now)
+    
+    # 关系
+    questions = relationship("Question", secondary=question_knowledge_points, back_populates="knowledge_points")
+
+
 class Question(Base):
     """问题表"""
     __tablename__ = "questions"
+    __table_args__ = (
+        Index("ix_questions_user_id_created_at", "user_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     content = Column(Text)  # 问题内容
     image_url = Column(String(500))  # 图片URL
+    thumbnail_url = Column(String(500))  # 缩略图URL
     subject = Column(String(50))  # 学科
-    knowledge_point = Column(String(100))  # 知识点
+    knowledge_point = Column(Text)  # 知识点（逗号分隔，可能有多个）
     created_at = Column(DateTime, default=datetime.now)
     
     # 关系
     user = relationship("User", back_populates="questions")
     answer = relationship("Answer", back_populates="question", uselist=False)
+    knowledge_points = relationship("KnowledgePoint", secondary=question_knowledge_points, back_populates="questions")
 
 
 class Answer(Base):
     """答案表"""
     __tablename__ = "answers"
+    __table_args__ = (
+        Index("ix_answers_question_id", "question_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     question_id = Column(Integer, ForeignKey("questions.id"))
@@ -68,6 +171,9 @@ class Answer(Base):
 class Essay(Base):
     """作文表"""
     __tablename__ = "essays"
+    __table_args__ = (
+        Index("ix_essays_user_id", "user_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -92,6 +198,10 @@ class Essay(Base):
 class WrongQuestion(Base):
     """错题本"""
     __tablename__ = "wrong_questions"
+    __table_args__ = (
+        Index("ix_wrong_questions_user_id_is_mastered_created_at", "user_id", "is_mastered", "created_at"),
+        Index("ix_wrong_questions_user_id_question_id", "user_id", "question_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -106,13 +216,40 @@ class WrongQuestion(Base):
     question = relationship("Question")
 
 
+class EssayJob(Base):
+    """作文批改任务队列"""
+    __tablename__ = "essay_jobs"
+    __table_args__ = (
+        Index("ix_essay_jobs_status_created_at", "status", "created_at"),
+        Index("ix_essay_jobs_user_id_created_at", "user_id", "created_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    title = Column(String(200))
+    content = Column(Text)
+    essay_type = Column(String(50))
+    status = Column(String(20), default="pending")  # pending/running/done/failed
+    result = Column(Text)  # 批改结果 (JSON格式)
+    error = Column(Text)
+    essay_id = Column(Integer, ForeignKey("essays.id"))
+    created_at = Column(DateTime, default=datetime.now)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+
 class ChatSession(Base):
     """聊天会话"""
     __tablename__ = "chat_sessions"
+    __table_args__ = (
+        Index("ix_chat_sessions_user_id_created_at", "user_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     title = Column(String(200))
+    summary = Column(Text)  # 早期对话的滚动摘要
+    summary_until = Column(Integer, default=0)  # 已并入摘要的最后一条消息ID
     created_at = Column(DateTime, default=datetime.now)
     
     # 关系
@@ -123,6 +260,9 @@ class ChatSession(Base):
 class ChatMessage(Base):
     """聊天消息"""
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        Index("ix_chat_messages_session_id_created_at", "session_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(Integer, ForeignKey("chat_sessions.id"))
@@ -137,14 +277,43 @@ class ChatMessage(Base):
 class Exercise(Base):
     """推荐练习题库"""
     __tablename__ = "exercises"
+    __table_args__ = (
+        Index("ix_exercises_subject_knowledge_point_difficulty", "subject", "knowledge_point", "difficulty"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     subject = Column(String(50))
-    knowledge_point = Column(String(100))
+    knowledge_point = Column(Text)
     difficulty = Column(Integer)  # 1-5
     content = Column(Text)
+    options = Column(Text)  # 选项 (JSON格式)
     answer = Column(Text)
     explanation = Column(Text)
+    source = Column(String(20), default="llm")  # llm/import
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class UserStats(Base):
+    """用户学习统计汇总（写入题目、错题、作文时同步更新）"""
+    __tablename__ = "user_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total_questions = Column(Integer, default=0)
+    wrong_count = Column(Integer, default=0)  # 未掌握的错题数
+    mastered_count = Column(Integer, default=0)
+    essay_count = Column(Integer, default=0)
+    essay_score_sum = Column(Float, default=0)
+    weak_points = Column(Text, default="{}")  # 未掌握错题的知识点计数 (JSON格式)
+    daily_questions = Column(Text, default="{}")  # 最近几天每天的题目数 (JSON格式)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class RevokedToken(Base):
+    """退出登录时吊销的令牌（多进程部署时各进程共用，记录到令牌本身过期为止）"""
+    __tablename__ = "revoked_tokens"
+    
+    token_hash = Column(String(64), primary_key=True)  # 令牌的sha256
+    expires_at = Column(DateTime, index=True)
 
 
 def init_db():
@@ -152,10 +321,7 @@ def init_db():
     Base.metadata.create_all(bind=engine)
 
 
-def get_db():
-    """获取数据库会话"""
-    db = SessionLocal()
-    try:
+async def get_db():
+    """获取数据库会话（异步）"""
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -1,27 +1,127 @@
 """认证服务"""
+import time
+import asyncio
+import hashlib
+import ipaddress
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status, Depends, Request
 from fastapi.security import HTTPBearer
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from config import (
+    SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES,
+    BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS,
+    LOGIN_THROTTLE_WINDOW, LOGIN_MAX_FAILURES_PER_USER, LOGIN_MAX_FAILURES_PER_IP, TRUSTED_PROXIES,
+    TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL
+)
+from models.database import AsyncSessionLocal, RevokedToken
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 security = HTTPBearer(auto_error=False)
 
+# bcrypt计算期间会释放GIL，放到专用线程池中既不阻塞事件循环，也限制了同时占用的CPU核数
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
 
-def hash_password(password: str) -> str:
+
+async def hash_password(password: str) -> str:
     """密码哈希"""
     # bcrypt限制密码最大72字节
-    return pwd_context.hash(password[:72])
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, pwd_context.hash, password[:72])
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """验证密码"""
-    return pwd_context.verify(plain_password[:72], hashed_password)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, pwd_context.verify, plain_password[:72], hashed_password)
+
+
+_trusted_proxies = [ipaddress.ip_network(p, strict=False) for p in TRUSTED_PROXIES]
+
+
+def _is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in _trusted_proxies)
+
+
+def client_ip(request: Request) -> str:
+    """客户端IP：直连时为对端地址；对端是可信代理时，取 X-Forwarded-For 中最后一个不是可信代理的地址"""
+    host = request.client.host if request.client else ""
+    if not _is_trusted_proxy(host):
+        return host
+    forwarded = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    # 从右往左跳过各级可信代理，更左边的地址可由客户端伪造
+    for address in reversed(forwarded):
+        if not _is_trusted_proxy(address):
+            return address
+    return forwarded[0] if forwarded else host
+
+
+class LoginThrottle:
+    """登录失败限流：时间窗口内同一用户名或同一IP失败次数过多时暂时拒绝登录
+
+    在校验密码之前检查，暴力破解的请求不会再消耗bcrypt的CPU时间。
+    """
+
+    def __init__(self, window: int = LOGIN_THROTTLE_WINDOW,
+                 max_per_user: int = LOGIN_MAX_FAILURES_PER_USER,
+                 max_per_ip: int = LOGIN_MAX_FAILURES_PER_IP,
+                 max_keys: int = 100000):
+        self.window = window
+        self.max_per_user = max_per_user
+        self.max_per_ip = max_per_ip
+        self.max_keys = max_keys
+        self.failures = OrderedDict()  # key -> 失败时间戳队列
+        self.lock = threading.Lock()
+
+    def _recent(self, key: str, now: float) -> deque:
+        attempts = self.failures.get(key)
+        if attempts is None:
+            return deque()
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        if not attempts:
+            del self.failures[key]
+        return attempts
+
+    def retry_after(self, username: str, ip: str) -> int:
+        """需要等待的秒数，0表示允许尝试"""
+        now = time.time()
+        wait = 0
+        with self.lock:
+            for key, limit in ((f"user:{username}", self.max_per_user), (f"ip:{ip}", self.max_per_ip)):
+                attempts = self._recent(key, now)
+                if len(attempts) >= limit:
+                    wait = max(wait, int(attempts[0] + self.window - now) + 1)
+        return wait
+
+    def record_failure(self, username: str, ip: str):
+        now = time.time()
+        with self.lock:
+            for key in (f"user:{username}", f"ip:{ip}"):
+                self.failures.setdefault(key, deque()).append(now)
+                self.failures.move_to_end(key)
+            while len(self.failures) > self.max_keys:
+                self.failures.popitem(last=False)
+
+    def reset(self, username: str):
+        """登录成功后清除该用户名的失败记录"""
+        with self.lock:
+            self.failures.pop(f"user:{username}", None)
+
+
+login_throttle = LoginThrottle()
 
 
 def create_access_token(data: dict) -> str:
@@ -42,24 +142,129 @@ def decode_token(token: str) -> dict:
         return None
 
 
-async def get_current_user(request: Request):
-    """从cookie或header获取当前用户"""
+class TokenCache:
+    """已验证令牌的进程内缓存（LRU + TTL）
+
+    缓存期限取 TTL 与令牌 exp 中较早者；退出登录时吊销的令牌在 exp 之前一直被拒绝。
+    吊销记录同时写入 revoked_tokens 表，其他进程在缓存未命中时检查，因此最迟 TTL 之后在所有进程中失效。
+    """
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_SIZE, ttl: int = TOKEN_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # token -> (payload, 过期时间)
+        self.revoked = {}  # token -> exp
+        self.lock = threading.Lock()
+
+    def get(self, token: str):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if expires_at <= now:
+                del self.entries[token]
+                return None
+            self.entries.move_to_end(token)
+            return payload
+
+    def put(self, token: str, payload: dict):
+        expires_at = min(time.time() + self.ttl, payload.get("exp", 0))
+        with self.lock:
+            self.entries[token] = (payload, expires_at)
+            self.entries.move_to_end(token)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def is_revoked(self, token: str) -> bool:
+        with self.lock:
+            return token in self.revoked
+
+    def revoke(self, token: str, payload: dict):
+        """吊销令牌：移出缓存并记录到令牌本身过期为止"""
+        now = time.time()
+        with self.lock:
+            self.entries.pop(token, None)
+            # 顺带清理已自然过期的吊销记录
+            self.revoked = {t: exp for t, exp in self.revoked.items() if exp > now}
+            self.revoked[token] = payload.get("exp", now)
+
+
+token_cache = TokenCache()
+
+
+def get_token(request: Request) -> str:
+    """从cookie或header中取出令牌"""
     token = request.cookies.get("access_token")
     if not token:
         auth = request.headers.get("Authorization")
         if auth and auth.startswith("Bearer "):
             token = auth.split(" ")[1]
-    
-    if not token:
+    return token
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def _is_revoked_shared(token: str) -> bool:
+    """检查其他进程记录的吊销"""
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(RevokedToken.token_hash).where(
+            RevokedToken.token_hash == _token_hash(token)
+        )) is not None
+
+
+async def verify_token(token: str) -> dict:
+    """校验令牌，优先使用缓存；无效、过期或已吊销时返回None"""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+    if token_cache.is_revoked(token):
         return None
-    
     payload = decode_token(token)
     if payload is None:
         return None
-    
+    if await _is_revoked_shared(token):
+        token_cache.revoke(token, payload)
+        return None
+    token_cache.put(token, payload)
     return payload
 
 
+async def revoke_token(request: Request):
+    """吊销当前请求携带的令牌（退出登录）"""
+    token = get_token(request)
+    if not token:
+        return
+    payload = await verify_token(token)
+    if payload is None:
+        return
+    token_cache.revoke(token, payload)
+    now = datetime.now()
+    async with AsyncSessionLocal() as db:
+        # 顺带清理已自然过期的吊销记录
+        await db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= now))
+        db.add(RevokedToken(
+            token_hash=_token_hash(token),
+            expires_at=datetime.fromtimestamp(payload["exp"]) if "exp" in payload else now
+        ))
+        try:
+            await db.commit()
+        except IntegrityError:
+            # 同一令牌已被吊销
+            pass
+
+
+async def get_current_user(request: Request):
+    """从cookie或header获取当前用户"""
+    token = get_token(request)
+    if not token:
+        return None
+    return await verify_token(token)
+
+
 async def require_auth(request: Request):
     """需要认证的路由依赖"""
     user = await get_current_user(request)
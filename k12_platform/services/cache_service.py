@@ -0,0 +1,150 @@
+"""解答缓存 - 相同题目直接返回已有解答，不再调用LLM"""
+import re
+import json
+import time
+import asyncio
+import logging
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_DB, ANSWER_CACHE_PRUNE_INTERVAL, SQLITE_BUSY_TIMEOUT_MS
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(text: str) -> str:
+    """规范化题目文本：全角转半角、统一大小写、去掉空白"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", "", text).lower()
+
+
+class AnswerCache:
+    """进程内LRU缓存（带TTL），可选SQLite共享层供多个进程复用
+
+    共享层的读写在线程池中执行，不阻塞事件循环；过期条目由 start() 启动的定时任务清理。
+    """
+
+    def __init__(self, ttl: int = ANSWER_CACHE_TTL, max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 db_path: str = ANSWER_CACHE_DB, prune_interval: int = ANSWER_CACHE_PRUNE_INTERVAL):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prune_interval = prune_interval
+        self.entries = OrderedDict()  # key -> (过期时间, 结果)，只在事件循环中访问
+        self.lock = threading.Lock()  # 共享层连接在线程池中使用
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.prune_task = None
+        self.conn = None
+        if db_path:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+            # 多个进程共享同一缓存文件，WAL模式下读写互不阻塞
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS answer_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS ix_answer_cache_expires_at ON answer_cache (expires_at)")
+            self.conn.commit()
+
+    def make_key(self, content: str, subject: str, image_base64: str = None) -> str:
+        """文字题按规范化内容+学科生成键，图片题再加上图片内容哈希"""
+        parts = [subject or "", normalize_question(content)]
+        if image_base64:
+            parts.append(hashlib.sha256(image_base64.encode()).hexdigest())
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def _shared_get(self, key: str, now: float):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT value, expires_at FROM answer_cache WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+
+    def _shared_set(self, key: str, value: str, expires_at: float):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO answer_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+            self.conn.commit()
+
+    def _prune(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM answer_cache WHERE expires_at <= ?", (time.time(),))
+            self.conn.commit()
+
+    async def get(self, key: str):
+        """查询缓存，未命中返回None"""
+        now = time.time()
+        item = self.entries.get(key)
+        if item and item[0] > now:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+        if item:
+            del self.entries[key]
+
+        if self.conn is not None:
+            row = await asyncio.to_thread(self._shared_get, key, now)
+            if row:
+                value = json.loads(row[0])
+                self._put_local(key, value, row[1])
+                self.shared_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: dict):
+        """写入缓存"""
+        expires_at = time.time() + self.ttl
+        self._put_local(key, value, expires_at)
+        if self.conn is not None:
+            await asyncio.to_thread(self._shared_set, key, json.dumps(value, ensure_ascii=False), expires_at)
+
+    async def _prune_loop(self):
+        while True:
+            await asyncio.sleep(self.prune_interval)
+            try:
+                await asyncio.to_thread(self._prune)
+            except sqlite3.Error:
+                logger.exception("清理过期解答缓存失败")
+
+    async def start(self):
+        """启动共享层的定时清理"""
+        if self.conn is not None and self.prune_task is None:
+            self.prune_task = asyncio.create_task(self._prune_loop())
+
+    async def stop(self):
+        if self.prune_task is not None:
+            self.prune_task.cancel()
+            await asyncio.gather(self.prune_task, return_exceptions=True)
+            self.prune_task = None
+
+    def _put_local(self, key: str, value: dict, expires_at: float):
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """命中统计"""
+        total = self.hits + self.shared_hits + self.misses
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.shared_hits) / max(total, 1) * 100, 1),
+            "entries": len(self.entries)
+        }
+
+
+# 全局实例
+answer_cache = AnswerCache()
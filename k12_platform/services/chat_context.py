@@ -0,0 +1,196 @@
+"""聊天上下文管理 - 最近几轮原样保留，更早的对话并入会话摘要，并按token预算截断
+
+会话历史缓存在进程内（LRU），每轮对话写入后追加到缓存，命中时无需重新查询历史。
+多进程部署时同一会话可能由其他进程写入，命中缓存后先核对数据库中未摘要消息的数量和最新ID，不一致时重新加载。
+"""
+import re
+import threading
+from collections import OrderedDict
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import CHAT_HISTORY_TURNS, CHAT_SUMMARY_TRIGGER_TURNS, CHAT_CONTEXT_TOKENS, CHAT_HISTORY_CACHE_SIZE
+from models.database import AsyncSessionLocal, ChatSession, ChatMessage
+from services.llm_service import llm_service
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """本地估算token数：中日文字符约1个token，其余约4个字符1个token"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4 + 4  # 每条消息另有少量格式开销
+
+
+class ChatHistoryCache:
+    """会话历史的进程内LRU缓存
+
+    每个条目：{"user_id", "summary", "summary_until", "messages": [{"id", "role", "content"}]}，
+    messages 只包含尚未并入摘要的消息。
+    """
+
+    def __init__(self, max_sessions: int = CHAT_HISTORY_CACHE_SIZE):
+        self.max_sessions = max_sessions
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session_id: int):
+        with self.lock:
+            entry = self.entries.get(session_id)
+            if entry is not None:
+                self.entries.move_to_end(session_id)
+            return entry
+
+    def put(self, session_id: int, entry: dict):
+        with self.lock:
+            self.entries[session_id] = entry
+            self.entries.move_to_end(session_id)
+            while len(self.entries) > self.max_sessions:
+                self.entries.popitem(last=False)
+
+    def append(self, session_id: int, messages: list):
+        """追加已写入数据库的消息"""
+        with self.lock:
+            entry = self.entries.get(session_id)
+            if entry is not None:
+                entry["messages"].extend(messages)
+
+    def apply_summary(self, session_id: int, summary: str, summary_until: int):
+        """摘要刷新后丢弃已并入摘要的消息"""
+        with self.lock:
+            entry = self.entries.get(session_id)
+            if entry is not None:
+                entry["summary"] = summary
+                entry["summary_until"] = summary_until
+                entry["messages"] = [m for m in entry["messages"] if m["id"] > summary_until]
+
+    def invalidate(self, session_id: int):
+        with self.lock:
+            self.entries.pop(session_id, None)
+
+
+history_cache = ChatHistoryCache()
+
+
+async def load_recent(db: AsyncSession, session: ChatSession) -> list:
+    """读取尚未并入摘要的消息"""
+    return (await db.scalars(select(ChatMessage).where(
+        ChatMessage.session_id == session.id,
+        ChatMessage.id > (session.summary_until or 0)
+    ).order_by(ChatMessage.id))).all()
+
+
+async def _is_current(db: AsyncSession, session_id: int, entry: dict) -> bool:
+    """缓存条目是否包含了数据库中全部未摘要的消息"""
+    count, last_id = (await db.execute(select(func.count(ChatMessage.id), func.max(ChatMessage.id)).where(
+        ChatMessage.session_id == session_id,
+        ChatMessage.id > entry["summary_until"]
+    ))).one()
+    messages = entry["messages"]
+    return count == len(messages) and (last_id or 0) == (messages[-1]["id"] if messages else 0)
+
+
+async def load_history(db: AsyncSession, session_id: int, user_id: int):
+    """获取会话历史（优先读缓存），会话不存在或不属于该用户时返回None"""
+    entry = history_cache.get(session_id)
+    if entry is not None and not await _is_current(db, session_id, entry):
+        entry = None
+    if entry is None:
+        session = await db.get(ChatSession, session_id)
+        if session is None:
+            return None
+        entry = {
+            "user_id": session.user_id,
+            "summary": session.summary,
+            "summary_until": session.summary_until or 0,
+            "messages": [{"id": m.id, "role": m.role, "content": m.content} for m in await load_recent(db, session)]
+        }
+        history_cache.put(session_id, entry)
+    if entry["user_id"] != user_id:
+        return None
+    return entry
+
+
+async def save_turn(db: AsyncSession, user_id: int, session_id: int, message: str, response: str) -> int:
+    """在一个事务中写入本轮的用户消息和助手回复（新会话同时创建会话），返回会话ID"""
+    if session_id is None:
+        session = ChatSession(user_id=user_id, title=message[:20], summary_until=0)
+        db.add(session)
+        await db.flush()
+        session_id = session.id
+        history_cache.put(session_id, {"user_id": user_id, "summary": None, "summary_until": 0, "messages": []})
+
+    user_msg = ChatMessage(session_id=session_id, role="user", content=message)
+    assistant_msg = ChatMessage(session_id=session_id, role="assistant", content=response)
+    db.add_all([user_msg, assistant_msg])
+    await db.flush()
+    cached = [
+        {"id": user_msg.id, "role": "user", "content": message},
+        {"id": assistant_msg.id, "role": "assistant", "content": response}
+    ]
+    await db.commit()
+
+    history_cache.append(session_id, cached)
+    return session_id
+
+
+def build_messages(summary: str, recent: list) -> list:
+    """组装发送给LLM的历史：摘要 + 全部未并入摘要的消息，超出token预算时从最早的消息开始丢弃
+
+    摘要累计到一定轮数才刷新，这期间移出最近几轮的消息仍要发送，否则既不在窗口也不在摘要中。
+    """
+    window = [{"role": m["role"], "content": m["content"]} for m in recent]
+
+    budget = CHAT_CONTEXT_TOKENS
+    prefix = []
+    if summary:
+        prefix.append({"role": "system", "content": f"此前对话的摘要：{summary}"})
+        budget -= estimate_tokens(prefix[0]["content"])
+
+    # 最新一条用户消息始终保留
+    kept = []
+    for message in reversed(window):
+        cost = estimate_tokens(message["content"])
+        if kept and cost > budget:
+            break
+        kept.append(message)
+        budget -= cost
+    return prefix + list(reversed(kept))
+
+
+def needs_summary(recent: list) -> bool:
+    """窗口外累计的对话是否已足够多，需要刷新摘要"""
+    return len(recent) >= (CHAT_HISTORY_TURNS + CHAT_SUMMARY_TRIGGER_TURNS) * 2
+
+
+async def refresh_summary(session_id: int):
+    """把窗口之外的早期消息并入会话摘要（在回复返回后于后台执行）"""
+    async with AsyncSessionLocal() as db:
+        session = await db.get(ChatSession, session_id)
+        if session is None:
+            return
+        recent = await load_recent(db, session)
+        if not needs_summary(recent):
+            return
+        old_summary, old_until = session.summary, session.summary_until
+        folded = recent[:-CHAT_HISTORY_TURNS * 2]
+        summary_until = folded[-1].id
+        messages = [{"role": m.role, "content": m.content} for m in folded]
+
+    summary = await llm_service.summarize_chat(old_summary, messages)
+    if not summary:
+        return
+
+    async with AsyncSessionLocal() as db:
+        # 只在摘要没有被并发刷新过时写入
+        updated = await db.execute(update(ChatSession).where(
+            ChatSession.id == session_id,
+            ChatSession.summary_until == old_until
+        ).values(summary=summary, summary_until=summary_until))
+        await db.commit()
+        if updated.rowcount:
+            history_cache.apply_summary(session_id, summary, summary_until)
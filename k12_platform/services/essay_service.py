@@ -0,0 +1,244 @@
+"""作文批改服务 - 保存批改结果，以及持久化的后台批改任务队列"""
+import json
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import ESSAY_WORKERS, ESSAY_BATCH_PARALLELISM, ESSAY_JOB_STALE_SECONDS
+from models.database import AsyncSessionLocal, Essay, EssayJob
+from services.llm_service import llm_service
+from services.llm_scheduler import LLMOverloaded
+from services import stats_service
+
+logger = logging.getLogger(__name__)
+
+
+async def save_essay(db: AsyncSession, user_id: int, title: str, content: str, essay_type: str, result: dict) -> Essay:
+    """保存作文批改结果并更新学习统计（由调用方提交）"""
+    await stats_service.record_essay(db, user_id, result.get("overall_score", 0))
+    essay = Essay(
+        user_id=user_id,
+        title=title,
+        content=content,
+        essay_type=essay_type,
+        overall_score=result.get("overall_score", 0),
+        structure_feedback=json.dumps(result.get("structure", {}), ensure_ascii=False),
+        grammar_feedback=json.dumps(result.get("grammar", {}), ensure_ascii=False),
+        vocabulary_feedback=json.dumps(result.get("vocabulary", {}), ensure_ascii=False),
+        suggestions=json.dumps(result.get("suggestions", []), ensure_ascii=False),
+        topic_analysis=json.dumps(result.get("topic_analysis", {}), ensure_ascii=False)
+    )
+    db.add(essay)
+    return essay
+
+
+_saving = set()  # 进行中的批量写入任务，保持引用直到完成
+
+
+async def save_batch(user_id: int, essays: list, results: dict) -> dict:
+    """在一个事务中写入批量批改的结果（results 为 {序号: 批改结果}，跳过失败的），返回 {序号: 作文ID}
+
+    写入在独立任务中进行，调用方被取消（如客户端断开）时仍会完成，已完成的批改不会丢失。
+    """
+    results = {index: result for index, result in results.items() if "error" not in result}
+    if not results:
+        return {}
+
+    async def save():
+        async with AsyncSessionLocal() as db:
+            saved = {
+                index: await save_essay(db, user_id, essays[index]["title"], essays[index]["content"],
+                                        essays[index]["essay_type"], result)
+                for index, result in sorted(results.items())
+            }
+            await db.commit()
+            return {index: essay.id for index, essay in saved.items()}
+
+    task = asyncio.ensure_future(save())
+    _saving.add(task)
+    task.add_done_callback(_saving.discard)
+    return await asyncio.shield(task)
+
+
+async def review_batch(essays: list, parallelism: int = ESSAY_BATCH_PARALLELISM, completed: dict = None):
+    """并发批改多篇作文，按完成顺序产出 (序号, 批改结果)
+
+    essays 为 {"title", "content", "essay_type"} 字典列表，同时进行的LLM调用不超过 parallelism。
+    completed 不为None时，每篇批改完成即写入 {序号: 批改结果}，包括调用方中途停止迭代时尚未取出的结果。
+    """
+    semaphore = asyncio.Semaphore(max(parallelism, 1))
+
+    async def review(index: int, essay: dict):
+        async with semaphore:
+            try:
+                result = await llm_service.review_essay(essay["title"], essay["content"], essay["essay_type"])
+            except Exception as e:
+                result = {"error": str(e)}
+            if completed is not None:
+                completed[index] = result
+            return index, result
+
+    tasks = [asyncio.create_task(review(i, essay)) for i, essay in enumerate(essays)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        # 客户端断开时取消尚未完成的批改
+        for task in tasks:
+            task.cancel()
+
+
+def job_to_dict(job: EssayJob) -> dict:
+    """任务状态"""
+    return {
+        "job_id": job.id,
+        "title": job.title,
+        "status": job.status,
+        "essay_id": job.essay_id,
+        "error": job.error,
+        "result": json.loads(job.result) if job.result else None,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+class EssayJobQueue:
+    """进程内作文批改队列
+
+    任务先写入 essay_jobs 表再入队，worker 数量即并发上限；
+    启动时把未完成的任务重新入队，服务重启后任务不会丢失。
+    多进程部署时各进程共用 essay_jobs 表：任务通过条件更新抢占，
+    批改中超过 ESSAY_JOB_STALE_SECONDS 的任务视为所在进程已退出，由其他进程定期回收。
+    """
+
+    def __init__(self, workers: int = ESSAY_WORKERS, stale_seconds: int = ESSAY_JOB_STALE_SECONDS):
+        self.workers = workers
+        self.stale_seconds = stale_seconds
+        self.queue = None
+        self.tasks = []
+
+    async def start(self):
+        """恢复未完成任务并启动worker"""
+        self.queue = asyncio.Queue()
+        await self._recover(all_pending=True)
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self._sweeper()))
+
+    async def stop(self):
+        """停止worker，未完成的任务留在表中等下次启动"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _recover(self, all_pending: bool = False):
+        """把超时未完成的任务重新排队
+
+        其他进程正在批改的任务不会被抢走。all_pending 为 False 时只回收排队过久的待批改任务
+        （提交它的进程可能已退出）；重复入队的任务在抢占时会被跳过。
+        """
+        stale_before = datetime.now() - timedelta(seconds=self.stale_seconds)
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(EssayJob).where(
+                EssayJob.status == "running",
+                EssayJob.started_at < stale_before
+            ).values(status="pending"))
+            await db.commit()
+            query = select(EssayJob.id).where(EssayJob.status == "pending")
+            if not all_pending:
+                query = query.where(EssayJob.created_at < stale_before)
+            pending = (await db.execute(query.order_by(EssayJob.created_at))).all()
+
+        for (job_id,) in pending:
+            self.queue.put_nowait(job_id)
+
+    async def _sweeper(self):
+        while True:
+            await asyncio.sleep(max(self.stale_seconds // 2, 1))
+            try:
+                await self._recover()
+            except Exception:
+                logger.exception("回收超时批改任务失败")
+
+    async def submit(self, db: AsyncSession, user_id: int, title: str, content: str, essay_type: str) -> EssayJob:
+        """创建批改任务并入队"""
+        job = EssayJob(user_id=user_id, title=title, content=content, essay_type=essay_type)
+        db.add(job)
+        await db.commit()
+        self.queue.put_nowait(job.id)
+        return job
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            except LLMOverloaded as e:
+                # LLM繁忙时任务退回待批改，稍后重新入队，不标记为失败
+                try:
+                    await self._release(job_id)
+                    asyncio.get_running_loop().call_later(e.retry_after, self.queue.put_nowait, job_id)
+                except Exception:
+                    logger.exception("批改任务 %s 退回待批改失败", job_id)
+            except Exception as e:
+                # 写入失败的任务停留在批改中，超时后由 _sweeper 回收；worker 继续处理后续任务
+                try:
+                    await self._finish(job_id, error=str(e))
+                except Exception:
+                    logger.exception("批改任务 %s 标记失败时出错", job_id)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job_id: int):
+        async with AsyncSessionLocal() as db:
+            # 抢占任务，避免多个进程重复批改
+            claimed = await db.execute(update(EssayJob).where(
+                EssayJob.id == job_id,
+                EssayJob.status == "pending"
+            ).values(status="running", started_at=datetime.now()))
+            await db.commit()
+            if not claimed.rowcount:
+                return
+            job = await db.get(EssayJob, job_id)
+            title, content, essay_type = job.title, job.content, job.essay_type
+
+        result = await llm_service.review_essay(title, content, essay_type)
+        if "error" in result:
+            await self._finish(job_id, error=result["error"])
+        else:
+            await self._finish(job_id, result=result)
+
+    async def _release(self, job_id: int):
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(EssayJob).where(
+                EssayJob.id == job_id,
+                EssayJob.status == "running"
+            ).values(status="pending", started_at=None))
+            await db.commit()
+
+    async def _finish(self, job_id: int, result: dict = None, error: str = None):
+        """写入批改结果（作文和任务状态在同一事务中）"""
+        async with AsyncSessionLocal() as db:
+            job = await db.get(EssayJob, job_id)
+            # 超时被回收后又由其他worker完成的任务不再重复写入
+            if job is None or job.status in ("done", "failed"):
+                return
+            if result is not None:
+                essay = await save_essay(db, job.user_id, job.title, job.content, job.essay_type, result)
+                await db.flush()
+                job.essay_id = essay.id
+                job.result = json.dumps(result, ensure_ascii=False)
+                job.status = "done"
+            else:
+                job.error = error
+                job.status = "failed"
+            job.finished_at = datetime.now()
+            await db.commit()
+
+
+# 全局实例
+essay_queue = EssayJobQueue()
@@ -0,0 +1,72 @@
+"""练习题库服务 - 优先从本地题库推荐，不足时再由LLM生成并入库"""
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import EXERCISE_FRESH_DAYS
+from models.database import Exercise
+
+
+def _match_point(knowledge_point: str, names: list) -> str:
+    """把LLM返回的知识点归到请求的薄弱知识点上，便于之后按知识点命中"""
+    knowledge_point = (knowledge_point or "").strip()
+    for name in names:
+        if knowledge_point == name or (knowledge_point and (name in knowledge_point or knowledge_point in name)):
+            return name
+    return knowledge_point or (names[0] if names else "")
+
+
+def save_exercises(db: Session, subject: str, items: list, knowledge_points: list = None, source: str = "llm") -> list:
+    """保存题目到题库，items 为LLM返回格式的字典列表（只调用 db.add，同步和异步会话均可）"""
+    exercises = []
+    for item in items:
+        if not isinstance(item, dict) or not item.get("question"):
+            continue
+        try:
+            difficulty = int(item.get("difficulty") or 3)
+        except (TypeError, ValueError):
+            difficulty = 3
+        exercise = Exercise(
+            subject=item.get("subject") or subject,
+            knowledge_point=_match_point(item.get("knowledge_point"), knowledge_points or []),
+            difficulty=min(max(difficulty, 1), 5),
+            content=item["question"],
+            options=json.dumps(item.get("options") or [], ensure_ascii=False),
+            answer=item.get("answer", ""),
+            explanation=item.get("explanation", ""),
+            source=source
+        )
+        db.add(exercise)
+        exercises.append(exercise)
+    return exercises
+
+
+async def pick_exercises(db: AsyncSession, subject: str, knowledge_points: list, count: int, difficulty: int = None) -> list:
+    """从题库中按学科、知识点（和难度）随机取题"""
+    cutoff = datetime.now() - timedelta(days=EXERCISE_FRESH_DAYS)
+    query = select(Exercise).where(
+        Exercise.subject == subject,
+        Exercise.knowledge_point.in_(knowledge_points),
+        # 导入的题目长期有效，LLM生成的题目过期后重新生成
+        or_(Exercise.source == "import", Exercise.created_at >= cutoff)
+    )
+    if difficulty:
+        query = query.where(Exercise.difficulty.between(difficulty - 1, difficulty + 1))
+    return (await db.scalars(query.order_by(func.random()).limit(count))).all()
+
+
+def to_dict(exercise: Exercise) -> dict:
+    """转换为推荐接口的返回格式（与LLM返回格式一致）"""
+    return {
+        "id": exercise.id,
+        "question": exercise.content,
+        "options": json.loads(exercise.options) if exercise.options else [],
+        "answer": exercise.answer,
+        "explanation": exercise.explanation,
+        "knowledge_point": exercise.knowledge_point,
+        "difficulty": exercise.difficulty
+    }
@@ -0,0 +1,110 @@
+"""图片预处理服务 - 上传的题目图片先纠正方向、缩小、重新压缩，再按内容哈希存储
+
+同一张图片重复上传只保存一份，并生成列表页使用的缩略图。
+上传内容分块写入临时文件，内存占用与图片大小无关，磁盘读写和解码都不在事件循环上执行。
+"""
+import io
+import uuid
+import asyncio
+import tempfile
+import hashlib
+import aiofiles
+import aiofiles.os
+from fastapi import HTTPException, UploadFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import IMAGE_MAX_EDGE, IMAGE_THUMB_EDGE, IMAGE_JPEG_QUALITY, UPLOAD_MAX_BYTES
+
+UPLOAD_DIR = "static/uploads"
+TMP_DIR = os.path.join(tempfile.gettempdir(), "k12_uploads")  # 不在 /static 下，写了一半的文件不能被访问
+CHUNK_SIZE = 64 * 1024
+
+# 解压炸弹保护：超过约一亿像素的图片直接拒绝
+Image.MAX_IMAGE_PIXELS = 100_000_000
+
+
+def _to_jpeg(image: Image.Image, max_edge: int) -> bytes:
+    """按最长边缩小并编码为JPEG"""
+    image = image.copy()
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def _normalize(path: str) -> Image.Image:
+    """解码图片，按EXIF纠正方向，透明背景铺白后转为RGB"""
+    try:
+        image = Image.open(path)
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise ValueError("无法识别的图片格式")
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def process_upload(path: str, digest: str) -> tuple:
+    """处理已落盘的上传图片，返回 (处理后的JPEG字节, 图片URL, 缩略图URL)
+
+    digest 为原始内容的sha256，作为文件名；已存在时直接复用，不再重复解码和压缩。
+    图片无法识别时抛出 ValueError。
+    """
+    directory = os.path.join(UPLOAD_DIR, digest[:2])
+    image_path = os.path.join(directory, f"{digest}.jpg")
+    thumb_path = os.path.join(directory, f"{digest}_thumb.jpg")
+
+    if os.path.exists(image_path) and os.path.exists(thumb_path):
+        with open(image_path, "rb") as f:
+            processed = f.read()
+    else:
+        image = _normalize(path)
+        processed = _to_jpeg(image, IMAGE_MAX_EDGE)
+        thumbnail = _to_jpeg(image, IMAGE_THUMB_EDGE)
+        os.makedirs(directory, exist_ok=True)
+        # 先写临时文件再改名，并发上传同一张图片时不会读到半个文件
+        for target, content in ((image_path, processed), (thumb_path, thumbnail)):
+            tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, target)
+
+    return processed, "/" + image_path, "/" + thumb_path
+
+
+async def save_upload(upload: UploadFile) -> tuple:
+    """分块读取上传的图片并处理，返回 (处理后的JPEG字节, 图片URL, 缩略图URL)
+
+    超过 UPLOAD_MAX_BYTES 时立即停止读取并返回413。
+    """
+    await aiofiles.os.makedirs(TMP_DIR, exist_ok=True)
+    tmp_path = os.path.join(TMP_DIR, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            while chunk := await upload.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"图片不能超过{UPLOAD_MAX_BYTES // (1024 * 1024)}MB")
+                digest.update(chunk)
+                await f.write(chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="上传的图片为空")
+
+        try:
+            # 解码和压缩是CPU密集操作，放到线程池中执行
+            return await asyncio.to_thread(process_upload, tmp_path, digest.hexdigest())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await upload.close()
+        if await aiofiles.os.path.exists(tmp_path):
+            await aiofiles.os.remove(tmp_path)
@@ -0,0 +1,120 @@
+"""增量JSON解析 - 从LLM的流式输出中尽早取出已完整的字段"""
+import json
+
+
+class IncrementalJSONParser:
+    """逐段喂入模型输出，解析顶层JSON对象
+
+    feed() 返回本次新完成的事件列表：
+    - ("item", key, value)：顶层数组字段中新完成的一个元素
+    - ("field", key, value)：新完成的一个顶层字段
+    对象开始前的内容（如 ```json 代码块标记）会被跳过。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.started = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.expect = "key"  # key / value / comma
+        self.key = None
+        self.key_start = None
+        self.value_start = None
+        self.container = None  # 当前顶层字段值的类型：[ / { / None
+        self.item_start = None
+
+    def feed(self, text: str) -> list:
+        """追加一段输出，返回新完成的事件"""
+        self.buffer += text
+        events = []
+        while self.pos < len(self.buffer) and not self.finished:
+            self._step(self.buffer[self.pos], events)
+            self.pos += 1
+        return events
+
+    def _load(self, start: int, end: int):
+        return json.loads(self.buffer[start:end])
+
+    def _finish_value(self, end: int, events: list):
+        events.append(("field", self.key, self._load(self.value_start, end)))
+        self.value_start = None
+        self.container = None
+        self.expect = "comma"
+
+    def _finish_item(self, end: int, events: list):
+        events.append(("item", self.key, self._load(self.item_start, end)))
+        self.item_start = None
+
+    def _step(self, ch: str, events: list):
+        i = self.pos
+        if not self.started:
+            if ch == "{":
+                self.started = True
+                self.depth = 1
+            return
+
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif ch == "\\":
+                self.escape = True
+            elif ch == '"':
+                self.in_string = False
+                if self.depth == 1:
+                    if self.expect == "key":
+                        self.key = self._load(self.key_start, i + 1)
+                    elif self.container is None:
+                        self._finish_value(i + 1, events)
+                elif self.depth == 2 and self.container == "[" and self.item_start is not None:
+                    self._finish_item(i + 1, events)
+            return
+
+        if ch == '"':
+            self.in_string = True
+            if self.depth == 1:
+                if self.expect == "key":
+                    self.key_start = i
+                elif self.value_start is None:
+                    self.value_start = i
+            elif self.depth == 2 and self.container == "[" and self.item_start is None:
+                self.item_start = i
+        elif ch in "{[":
+            if self.depth == 1 and self.value_start is None:
+                self.value_start = i
+                self.container = ch
+            elif self.depth == 2 and self.container == "[" and self.item_start is None:
+                self.item_start = i
+            self.depth += 1
+        elif ch in "}]":
+            if self.depth == 3 and self.container == "[" and self.item_start is not None:
+                self.depth -= 1
+                self._finish_item(i + 1, events)
+                return
+            if self.depth == 2 and self.container == "[" and self.item_start is not None:
+                self._finish_item(i, events)
+            if self.depth == 1:
+                # 顶层对象结束，补上末尾的数字/布尔值
+                if self.value_start is not None:
+                    self._finish_value(i, events)
+                self.finished = True
+            self.depth -= 1
+            if self.depth == 1 and self.container is not None:
+                self._finish_value(i + 1, events)
+        elif ch == ":" and self.depth == 1:
+            self.expect = "value"
+        elif ch == ",":
+            if self.depth == 1:
+                if self.value_start is not None:
+                    self._finish_value(i, events)
+                self.expect = "key"
+            elif self.depth == 2 and self.container == "[" and self.item_start is not None:
+                self._finish_item(i, events)
+        elif not ch.isspace():
+            # 数字、true/false/null 等标量
+            if self.depth == 1 and self.expect == "value" and self.value_start is None:
+                self.value_start = i
+            elif self.depth == 2 and self.container == "[" and self.item_start is None:
+                self.item_start = i
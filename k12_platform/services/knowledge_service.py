@@ -0,0 +1,69 @@
+"""知识点服务 - 维护知识点维表，并用 GROUP BY 统计薄弱知识点"""
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models.database import Question, WrongQuestion, KnowledgePoint, question_knowledge_points
+
+
+async def get_or_create_points(db: AsyncSession, names: list) -> list:
+    """按名称获取知识点，不存在的新建（并发请求同时新建同名知识点时不冲突）"""
+    names = list(dict.fromkeys(n.strip() for n in names if n and n.strip()))
+    if not names:
+        return []
+
+    existing = {
+        kp.name: kp
+        for kp in await db.scalars(select(KnowledgePoint).where(KnowledgePoint.name.in_(names)))
+    }
+    missing = [name for name in names if name not in existing]
+    if missing:
+        dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+        await db.execute(
+            dialect.insert(KnowledgePoint).values([{"name": name} for name in missing])
+            .on_conflict_do_nothing(index_elements=["name"])
+        )
+        for kp in await db.scalars(select(KnowledgePoint).where(KnowledgePoint.name.in_(missing))):
+            existing[kp.name] = kp
+    return [existing[name] for name in names]
+
+
+async def link_question(db: AsyncSession, question: Question, names: list):
+    """为题目关联知识点"""
+    question.knowledge_points = await get_or_create_points(db, names)
+
+
+async def weak_points(db: AsyncSession, user_id: int, limit: int = 5) -> list:
+    """按未掌握错题数排序的薄弱知识点，返回 [(名称, 次数)]"""
+    count = func.count(WrongQuestion.id)
+    rows = await db.execute(select(KnowledgePoint.name, count).join(
+        question_knowledge_points, question_knowledge_points.c.knowledge_point_id == KnowledgePoint.id
+    ).join(
+        WrongQuestion, WrongQuestion.question_id == question_knowledge_points.c.question_id
+    ).where(
+        WrongQuestion.user_id == user_id,
+        WrongQuestion.is_mastered == False
+    ).group_by(KnowledgePoint.name).order_by(count.desc()).limit(limit))
+    return rows.all()
+
+
+async def weak_subject(db: AsyncSession, user_id: int):
+    """未掌握错题最多的学科"""
+    count = func.count(WrongQuestion.id)
+    row = (await db.execute(select(Question.subject, count).join(
+        WrongQuestion, WrongQuestion.question_id == Question.id
+    ).where(
+        WrongQuestion.user_id == user_id,
+        WrongQuestion.is_mastered == False,
+        Question.subject.isnot(None)
+    ).group_by(Question.subject).order_by(count.desc()).limit(1))).first()
+    return row[0] if row else None
+
+
+def question_ids_with_point(name: str):
+    """关联了指定知识点的题目ID子查询"""
+    return select(question_knowledge_points.c.question_id).join(
+        KnowledgePoint, KnowledgePoint.id == question_knowledge_points.c.knowledge_point_id
+    ).where(KnowledgePoint.name == name)
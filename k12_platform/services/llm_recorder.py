@@ -0,0 +1,146 @@
+"""LLM调用录制与回放 - 离线压测和CI不依赖真实上游
+
+record 模式下正常调用上游，把每个成功的响应连同耗时保存为 LLM_RECORD_DIR 下的JSON文件；
+replay 模式下不访问上游，按请求内容找到录制文件，按录制时的耗时（乘以 LLM_REPLAY_SPEED）返回相同的响应，
+流式响应按录制时每段到达的时间逐段返回。找不到录制时抛出 RecordingNotFound。
+
+录制按请求内容（消息、temperature、max_tokens、是否流式、response_format）的sha256区分，不含模型名，
+因此录制后更换 OPENAI_MODEL 仍可回放。
+"""
+import json
+import time
+import asyncio
+import hashlib
+from pathlib import Path
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import LLM_RECORD_MODE, LLM_RECORD_DIR, LLM_REPLAY_SPEED
+
+MODES = ("off", "record", "replay")
+KEY_FIELDS = ("messages", "temperature", "max_tokens", "stream", "response_format")
+
+
+class RecordingNotFound(LookupError):
+    """回放模式下没有该请求的录制"""
+
+
+def _redact(messages: list) -> list:
+    """保存到文件的请求中用图片的哈希代替图片数据"""
+    result = []
+    for message in messages:
+        content = message["content"]
+        if not isinstance(content, str):
+            content = [
+                {"type": "image_url", "image_url": {"url": "sha256:" + hashlib.sha256(part["image_url"]["url"].encode()).hexdigest()}}
+                if part["type"] == "image_url" else part
+                for part in content
+            ]
+        result.append({**message, "content": content})
+    return result
+
+
+class ReplayStream:
+    """按录制时间逐段返回的流式响应，接口与SDK的 AsyncStream 一致（异步迭代和 close）"""
+
+    def __init__(self, chunks: list, speed: float):
+        self.chunks = chunks  # [(相对请求开始的秒数, chunk字典)]
+        self.speed = speed
+
+    async def __aiter__(self):
+        start = time.monotonic()
+        for offset, data in self.chunks:
+            delay = start + offset * self.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield ChatCompletionChunk.model_validate(data)
+
+    async def close(self):
+        pass
+
+
+class RecordingStream:
+    """包装上游的流式响应，完整读完后保存录制；中途关闭的不保存"""
+
+    def __init__(self, recorder, request: dict, stream, start: float):
+        self.recorder = recorder
+        self.request = request
+        self.stream = stream
+        self.start = start
+
+    async def __aiter__(self):
+        chunks = []
+        async for chunk in self.stream:
+            chunks.append((round(time.monotonic() - self.start, 4), chunk.model_dump(exclude_unset=True)))
+            yield chunk
+        await self.recorder.save(self.request, {"chunks": chunks})
+
+    async def close(self):
+        await self.stream.close()
+
+
+class LLMRecorder:
+    def __init__(self, mode: str = LLM_RECORD_MODE, directory: str = LLM_RECORD_DIR, speed: float = LLM_REPLAY_SPEED):
+        if mode not in MODES:
+            raise ValueError(f"LLM_RECORD_MODE 应为 {'/'.join(MODES)}，而不是 {mode}")
+        self.mode = mode
+        self.directory = Path(directory)
+        self.speed = max(speed, 0)
+        self.counts = {"recorded": 0, "replayed": 0, "missing": 0}
+
+    @staticmethod
+    def key(request: dict) -> str:
+        data = {name: request.get(name) for name in KEY_FIELDS}
+        return hashlib.sha256(json.dumps(data, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _write(self, path: Path, data: dict):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再改名，并发录制同一请求时不会读到写了一半的文件
+        temp = path.with_suffix(f".{os.getpid()}.{id(data)}.tmp")
+        temp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(temp, path)
+
+    async def save(self, request: dict, response: dict):
+        key = self.key(request)
+        data = {
+            "key": key,
+            "model": request.get("model"),
+            "request": {name: request.get(name) for name in KEY_FIELDS if name != "messages"},
+            "messages": _redact(request["messages"]),
+            **response
+        }
+        await asyncio.to_thread(self._write, self._path(key), data)
+        self.counts["recorded"] += 1
+
+    async def record(self, request: dict, response, start: float):
+        """保存非流式响应；流式响应返回包装后的对象，读完后保存"""
+        if request.get("stream"):
+            return RecordingStream(self, request, response, start)
+        await self.save(request, {"latency": round(time.monotonic() - start, 4), "response": response.model_dump()})
+        return response
+
+    async def replay(self, request: dict):
+        """返回录制的响应（ChatCompletion 或 ReplayStream）"""
+        path = self._path(self.key(request))
+        try:
+            data = json.loads(await asyncio.to_thread(path.read_text, encoding="utf-8"))
+        except FileNotFoundError:
+            self.counts["missing"] += 1
+            raise RecordingNotFound(f"没有该请求的录制（{path.name}），请先以 LLM_RECORD_MODE=record 运行")
+        self.counts["replayed"] += 1
+        if request.get("stream"):
+            return ReplayStream(data["chunks"], self.speed)
+        if self.speed:
+            await asyncio.sleep(data["latency"] * self.speed)
+        return ChatCompletion.model_validate(data["response"])
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, **self.counts}
+
+
+# 全局实例
+llm_recorder = LLMRecorder()
@@ -0,0 +1,104 @@
+"""LLM上游调用的容错 - 可重试错误判断、带抖动的指数退避、耗时统计和熔断器"""
+import math
+import time
+import random
+import asyncio
+from collections import deque
+import openai
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY, LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN
+from services.llm_scheduler import LLMOverloaded
+
+
+def is_retryable(error: Exception) -> bool:
+    """连接失败、超时、限流和服务端错误可以重试，请求本身有误（4xx）则不重试"""
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError, TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def backoff_delay(attempt: int, error: Exception = None) -> float:
+    """第 attempt 次重试前的等待时间（full jitter），上游返回 Retry-After 时不少于该值"""
+    delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+    if isinstance(error, openai.APIStatusError):
+        retry_after = error.response.headers.get("retry-after", "")
+        try:
+            delay = max(delay, min(float(retry_after), LLM_RETRY_MAX_DELAY))
+        except ValueError:
+            pass
+    return delay
+
+
+class LatencyTracker:
+    """按通道记录最近成功调用的耗时，用于计算对冲请求的等待时间"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self.samples = {}
+        self.size = size
+
+    def record(self, lane: str, seconds: float):
+        self.samples.setdefault(lane, deque(maxlen=self.size)).append(seconds)
+
+    def p95(self, lane: str):
+        """样本不足时返回None"""
+        samples = self.samples.get(lane)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(len(ordered) * 0.95)]
+
+
+class CircuitBreaker:
+    """熔断器：连续失败达到阈值后打开，冷却期内直接拒绝；冷却结束后放行一个探测请求，成功则恢复"""
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.failure_threshold = max(failure_threshold, 1)
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = None
+        self.opened_count = 0
+
+    def ensure_available(self):
+        """冷却期内抛出 LLMOverloaded（503），不占用探测名额"""
+        if self.state == "open":
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining > 0:
+                raise LLMOverloaded("AI服务暂时不可用，请稍后再试", max(math.ceil(remaining), 1), 503)
+
+    def check(self):
+        """调用前检查：冷却期内抛出 LLMOverloaded（503），半开状态下只放行一个探测请求"""
+        if self.state == "closed":
+            return
+        self.ensure_available()
+        now = time.monotonic()
+        if self.state == "open":
+            self.state = "half_open"
+            self.probe_started = None
+        # 探测请求进行中时拒绝其他请求；探测请求被取消、迟迟没有结果时允许重新探测
+        if self.probe_started is not None and now - self.probe_started < self.cooldown:
+            raise LLMOverloaded("AI服务暂时不可用，请稍后再试", max(math.ceil(self.cooldown), 1), 503)
+        self.probe_started = now
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened_count += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.probe_started = None
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, "opened": self.opened_count}
@@ -0,0 +1,216 @@
+"""LLM调用准入调度 - 全局并发上限、每分钟token预算和按优先级排队
+
+调用按用途分为三条通道，优先级从高到低：interactive（解题、聊天）、recommend（练习推荐）、
+batch（作文批改、会话摘要等后台调用）。有空闲名额时总是先放行高优先级通道的请求；
+各通道的排队数有上限，排满或等待超时时立即抛出 LLMOverloaded，由接口返回429/503和 Retry-After，
+不让请求无限堆积。
+"""
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (
+    LLM_MAX_CONCURRENCY, LLM_TOKENS_PER_MINUTE, LLM_QUEUE_TIMEOUT,
+    LLM_QUEUE_INTERACTIVE, LLM_QUEUE_RECOMMEND, LLM_QUEUE_BATCH
+)
+
+LANES = ("interactive", "recommend", "batch")
+WINDOW_SECONDS = 60
+
+
+class LLMOverloaded(Exception):
+    """LLM调用排队已满或等待超时
+
+    status_code 为429（每分钟token预算用尽）或503（并发已满），retry_after 为建议的重试间隔（秒）。
+    """
+
+    def __init__(self, message: str, retry_after: int, status_code: int = 503):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class LLMScheduler:
+    """进程内的LLM调用准入调度器（只在事件循环线程中使用，无需加锁）"""
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+                 queue_limits: dict = None, queue_timeout: float = LLM_QUEUE_TIMEOUT):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.tokens_per_minute = tokens_per_minute
+        self.queue_limits = queue_limits or {
+            "interactive": LLM_QUEUE_INTERACTIVE,
+            "recommend": LLM_QUEUE_RECOMMEND,
+            "batch": LLM_QUEUE_BATCH
+        }
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiters = {lane: deque() for lane in LANES}  # (future, 预计token数)
+        self.window = deque()  # 最近一分钟放行的调用：{"at": 放行时间, "tokens": token数}
+        self.window_tokens = 0
+        self.wake_handle = None
+        self.avg_duration = 5.0  # 单次调用平均耗时（秒，指数移动平均），用于估算 Retry-After
+        self.stats_by_lane = {
+            lane: {"admitted": 0, "rejected": 0, "wait_total": 0.0, "wait_max": 0.0, "waits": deque(maxlen=1000)}
+            for lane in LANES
+        }
+
+    def _expire(self):
+        """移出一分钟以前的调用"""
+        cutoff = time.monotonic() - WINDOW_SECONDS
+        while self.window and self.window[0]["at"] <= cutoff:
+            self.window_tokens -= self.window.popleft()["tokens"]
+
+    def _fits(self, tokens: int) -> bool:
+        if self.active >= self.max_concurrency:
+            return False
+        return not self.tokens_per_minute or self.window_tokens + tokens <= self.tokens_per_minute
+
+    def _ahead(self, lane: str) -> int:
+        """排在该通道新请求前面的请求数（同优先级及更高优先级）"""
+        return sum(len(self.waiters[name]) for name in LANES[:LANES.index(lane) + 1])
+
+    def _admit(self, tokens: int) -> dict:
+        self.active += 1
+        entry = {"at": time.monotonic(), "tokens": tokens}
+        self.window.append(entry)
+        self.window_tokens += tokens
+        return entry
+
+    def _dispatch(self):
+        """按优先级放行排队的请求；只被token预算挡住时，在最早的记录过期后再试"""
+        self._expire()
+        for lane in LANES:
+            queue = self.waiters[lane]
+            while queue:
+                future, tokens = queue[0]
+                if future.done():
+                    queue.popleft()
+                    continue
+                if not self._fits(tokens):
+                    if self.active < self.max_concurrency and self.window and self.wake_handle is None:
+                        delay = max(self.window[0]["at"] + WINDOW_SECONDS - time.monotonic(), 0.01)
+                        self.wake_handle = asyncio.get_running_loop().call_later(delay, self._wake)
+                    return
+                queue.popleft()
+                future.set_result(self._admit(tokens))
+
+    def _wake(self):
+        self.wake_handle = None
+        self._dispatch()
+
+    def _retry_after(self, lane: str, tokens: int) -> int:
+        """估算排到该请求需要的时间"""
+        if self.tokens_per_minute and self.window_tokens + tokens > self.tokens_per_minute:
+            needed = self.window_tokens + tokens - self.tokens_per_minute
+            for entry in self.window:
+                needed -= entry["tokens"]
+                if needed <= 0:
+                    return max(math.ceil(entry["at"] + WINDOW_SECONDS - time.monotonic()), 1)
+            return WINDOW_SECONDS
+        return max(math.ceil(self.avg_duration * (self._ahead(lane) + 1) / self.max_concurrency), 1)
+
+    def _overloaded(self, lane: str, tokens: int) -> LLMOverloaded:
+        self.stats_by_lane[lane]["rejected"] += 1
+        if self.tokens_per_minute and self.window_tokens + tokens > self.tokens_per_minute:
+            return LLMOverloaded("AI服务调用过于频繁，请稍后再试", self._retry_after(lane, tokens), 429)
+        return LLMOverloaded("AI服务繁忙，请稍后再试", self._retry_after(lane, tokens), 503)
+
+    def check(self, lane: str):
+        """不排队，只检查该通道是否已排满（流式接口在开始响应前调用，以便返回429/503）"""
+        self._expire()
+        if len(self.waiters[lane]) >= self.queue_limits[lane]:
+            raise self._overloaded(lane, 0)
+
+    async def acquire(self, lane: str, tokens: int) -> dict:
+        """等待放行，返回本次调用的记录（传给 release）"""
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        self._expire()
+        start = time.monotonic()
+        if self._ahead(lane) == 0 and self._fits(tokens):
+            entry = self._admit(tokens)
+        else:
+            if len(self.waiters[lane]) >= self.queue_limits[lane]:
+                raise self._overloaded(lane, tokens)
+            future = asyncio.get_running_loop().create_future()
+            self.waiters[lane].append((future, tokens))
+            try:
+                entry = await asyncio.wait_for(future, self.queue_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                self._remove(lane, future)
+                # 放行和超时/取消同时发生时归还名额
+                if future.done() and not future.cancelled():
+                    self.release(future.result())
+                if isinstance(e, asyncio.TimeoutError):
+                    raise self._overloaded(lane, tokens)
+                raise
+
+        waited = time.monotonic() - start
+        stats = self.stats_by_lane[lane]
+        stats["admitted"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+        stats["waits"].append(waited)
+        return entry
+
+    def try_acquire(self, lane: str, tokens: int):
+        """不排队，有空闲名额时立即放行并返回记录，否则返回None（用于对冲请求）"""
+        self._expire()
+        if self._ahead(lane) == 0 and self._fits(tokens):
+            return self._admit(tokens)
+        return None
+
+    def _remove(self, lane: str, future):
+        self.waiters[lane] = deque(item for item in self.waiters[lane] if item[0] is not future)
+
+    def release(self, entry: dict, used_tokens: int = None):
+        """调用结束，归还名额；used_tokens 为接口返回的实际用量，用于修正预算"""
+        self.active -= 1
+        self.avg_duration = self.avg_duration * 0.9 + (time.monotonic() - entry["at"]) * 0.1
+        # 已移出统计窗口的记录不再修正
+        if used_tokens is not None and entry["at"] > time.monotonic() - WINDOW_SECONDS:
+            self.window_tokens += used_tokens - entry["tokens"]
+            entry["tokens"] = used_tokens
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, lane: str, tokens: int):
+        """async with scheduler.slot(lane, tokens) as usage: ...，可在 usage["tokens"] 中写入实际用量"""
+        entry = await self.acquire(lane, tokens)
+        usage = {"tokens": None}
+        try:
+            yield usage
+        finally:
+            self.release(entry, usage["tokens"])
+
+    def stats(self) -> dict:
+        """队列深度、等待时间等指标"""
+        self._expire()
+        lanes = {}
+        for lane in LANES:
+            stats = self.stats_by_lane[lane]
+            waits = sorted(stats["waits"])
+            lanes[lane] = {
+                "queued": len(self.waiters[lane]),
+                "queue_limit": self.queue_limits[lane],
+                "admitted": stats["admitted"],
+                "rejected": stats["rejected"],
+                "wait_avg_ms": round(stats["wait_total"] / max(stats["admitted"], 1) * 1000, 1),
+                "wait_p95_ms": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0,
+                "wait_max_ms": round(stats["wait_max"] * 1000, 1)
+            }
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "tokens_last_minute": self.window_tokens,
+            "tokens_per_minute": self.tokens_per_minute,
+            "lanes": lanes
+        }
+
+
+# 全局实例
+llm_scheduler = LLMScheduler()
@@ -1,23 +1,295 @@
 """LLM服务 - 调用OpenAI标准接口"""
-import json
-import base64
-from openai import OpenAI
+import time
+import asyncio
+import hashlib
+import httpx
+import openai
+from openai import AsyncOpenAI
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL
+from config import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL,
+    LLM_TIMEOUT, LLM_DEADLINE, LLM_CONNECT_TIMEOUT, LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_RETRY_ATTEMPTS, LLM_HEDGE, LLM_HEDGE_MIN_DELAY, LLM_JSON_MODE, LLM_JSON_REPAIR
+)
+from services.json_stream import IncrementalJSONParser
+from services.cache_service import normalize_question
+from services.llm_scheduler import llm_scheduler, LLMOverloaded
+from services.llm_resilience import is_retryable, backoff_delay, LatencyTracker, CircuitBreaker
+from services.llm_recorder import llm_recorder
+from services import structured_output
+from services.structured_output import SOLUTION_SCHEMA, ESSAY_SCHEMA, EXERCISES_SCHEMA
 
 
 class LLMService:
     def __init__(self):
-        self.client = OpenAI(
+        # 复用连接池，同一worker内可同时挂起多个请求
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS
+            ),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+        )
+        # 重试由本服务统一处理（受总时限和熔断约束），关闭SDK自带的重试
+        self.client = AsyncOpenAI(
             api_key=OPENAI_API_KEY,
-            base_url=OPENAI_BASE_URL
+            base_url=OPENAI_BASE_URL,
+            http_client=self.http_client,
+            max_retries=0
         )
         self.model = OPENAI_MODEL
+        self.scheduler = llm_scheduler
+        self.recorder = llm_recorder
+        self.inflight = {}  # 合并键 -> 进行中的调用
+        self.coalesced = 0
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker()
+        self.upstream_stats = {"retries": 0, "hedged": 0, "hedge_wins": 0}
+        self.json_mode = LLM_JSON_MODE
+        self.output_stats = {"parsed": 0, "locally_repaired": 0, "model_repaired": 0, "failed": 0}
+    
+    async def aclose(self):
+        """关闭连接池"""
+        await self.client.close()
+    
+    @staticmethod
+    def _estimate_tokens(messages: list, max_tokens: int) -> int:
+        """估算一次调用的token用量（提示词按字符数估算，每张图片按1000计，再加上max_tokens）"""
+        tokens = max_tokens
+        for message in messages:
+            content = message["content"]
+            if isinstance(content, str):
+                tokens += len(content)
+            else:
+                tokens += sum(len(part.get("text", "")) if part["type"] == "text" else 1000 for part in content)
+        return tokens
+    
+    async def _send(self, request: dict, timeout: float):
+        """发出一次请求；录制模式下保存响应，回放模式下直接返回录制的响应，不访问上游"""
+        if self.recorder.mode == "replay":
+            return await self.recorder.replay(request)
+        start = time.monotonic()
+        response = await self.client.chat.completions.create(**request, timeout=timeout)
+        if self.recorder.mode == "record":
+            response = await self.recorder.record(request, response, start)
+        return response
+    
+    async def _attempt(self, request: dict, lane: str, deadline: float):
+        """发出一次请求，超过单次超时或总时限时抛出 TimeoutError"""
+        timeout = min(LLM_TIMEOUT, deadline - time.monotonic())
+        if timeout <= 0:
+            raise TimeoutError("AI服务响应超时")
+        start = time.monotonic()
+        try:
+            # httpx的超时只限制每次读取，这里再限制整个请求的耗时
+            response = await asyncio.wait_for(self._send(request, timeout), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("AI服务响应超时")
+        if not request.get("stream"):
+            self.latency.record(lane, time.monotonic() - start)
+        return response
+    
+    async def _hedged_attempt(self, request: dict, lane: str, tokens: int, deadline: float):
+        """解题、聊天请求超过近期p95耗时仍未返回时，如有空闲名额再发一个相同请求，取先成功的结果"""
+        delay = self.latency.p95(lane)
+        if not LLM_HEDGE or lane != "interactive" or delay is None:
+            return await self._attempt(request, lane, deadline)
+        
+        tasks = [asyncio.ensure_future(self._attempt(request, lane, deadline))]
+        entry = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=max(delay, LLM_HEDGE_MIN_DELAY))
+            if not done:
+                entry = self.scheduler.try_acquire(lane, tokens)
+                if entry is not None:
+                    self.upstream_stats["hedged"] += 1
+                    tasks.append(asyncio.ensure_future(self._attempt(request, lane, deadline)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.upstream_stats["hedge_wins"] += 1
+                        return task.result()
+            return tasks[0].result()  # 都失败时抛出第一个请求的错误
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if entry is not None:
+                self.scheduler.release(entry)
     
-    def solve_math_question(self, question: str, image_base64: str = None) -> dict:
-        """解答数理题目，返回分步骤解析"""
+    async def _call(self, request: dict, lane: str, tokens: int, deadline: float):
+        """发出请求，可重试的错误按带抖动的指数退避重试，直到次数用完或超过总时限"""
+        attempt = 0
+        while True:
+            try:
+                if request.get("stream"):
+                    response = await self._attempt(request, lane, deadline)
+                else:
+                    response = await self._hedged_attempt(request, lane, tokens, deadline)
+                self.breaker.record_success()
+                return response
+            except Exception as e:
+                if not is_retryable(e):
+                    # 上游能正常返回错误响应（如400），说明服务可用
+                    if isinstance(e, openai.APIStatusError):
+                        self.breaker.record_success()
+                    raise
+                # 限流说明上游可用，交给退避和准入调度处理，不计入熔断
+                if not isinstance(e, openai.RateLimitError):
+                    self.breaker.record_failure()
+                delay = backoff_delay(attempt, e)
+                attempt += 1
+                if attempt > LLM_RETRY_ATTEMPTS or time.monotonic() + delay >= deadline:
+                    raise
+                self.breaker.check()
+                self.upstream_stats["retries"] += 1
+                await asyncio.sleep(delay)
+    
+    def _request(self, messages: list, temperature: float, max_tokens: int, stream: bool = False,
+                 json_mode: bool = False) -> dict:
+        request = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": stream
+        }
+        if json_mode and self.json_mode:
+            request["response_format"] = {"type": "json_object"}
+        return request
+    
+    @staticmethod
+    def _rejects_json_mode(error: openai.BadRequestError) -> bool:
+        """400错误是否针对 response_format（内容审核等其他原因的400不算）"""
+        message = (error.message or "").lower()
+        return error.param == "response_format" or "response_format" in message or "json_object" in message
+    
+    async def _call_json_fallback(self, request: dict, lane: str, tokens: int, deadline: float):
+        """上游因不支持JSON模式返回400时，去掉 response_format 重试，此后不再请求JSON模式"""
+        try:
+            return await self._call(request, lane, tokens, deadline)
+        except openai.BadRequestError as e:
+            if "response_format" not in request or not self._rejects_json_mode(e):
+                raise
+            self.json_mode = False
+            request.pop("response_format")
+            return await self._call(request, lane, tokens, deadline)
+    
+    async def _create(self, messages: list, temperature: float, max_tokens: int, lane: str, timeout: float = None,
+                      json_mode: bool = False):
+        """调用chat completions接口
+
+        lane 为准入调度通道；timeout 为本次调用（含排队和重试）的总时限（秒），默认 LLM_DEADLINE；
+        json_mode 为True时请求JSON输出。熔断中时直接抛出 LLMOverloaded。
+        """
+        deadline = time.monotonic() + (timeout or LLM_DEADLINE)
+        self.breaker.check()
+        tokens = self._estimate_tokens(messages, max_tokens)
+        async with self.scheduler.slot(lane, tokens) as usage:
+            request = self._request(messages, temperature, max_tokens, json_mode=json_mode)
+            response = await self._call_json_fallback(request, lane, tokens, deadline)
+            if response.usage:
+                usage["tokens"] = response.usage.total_tokens
+            return response
+    
+    async def _stream(self, messages: list, temperature: float, max_tokens: int, lane: str, timeout: float = None,
+                      json_mode: bool = False):
+        """流式调用chat completions接口，逐段产出回复文本；输出结束前一直占用调度名额
+
+        只有建立连接、收到响应头之前的失败会重试，开始输出后不再重试，整个输出同样受总时限约束。
+        """
+        deadline = time.monotonic() + (timeout or LLM_DEADLINE)
+        self.breaker.check()
+        tokens = self._estimate_tokens(messages, max_tokens)
+        async with self.scheduler.slot(lane, tokens):
+            request = self._request(messages, temperature, max_tokens, stream=True, json_mode=json_mode)
+            stream = await self._call_json_fallback(request, lane, tokens, deadline)
+            chunks = stream.__aiter__()
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), max(deadline - time.monotonic(), 0))
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        self.breaker.record_failure()
+                        raise TimeoutError("AI服务响应超时")
+                    except Exception as e:
+                        if is_retryable(e):
+                            self.breaker.record_failure()
+                        raise
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+    
+    def check_available(self, lane: str):
+        """不发起调用，只检查是否会被立即拒绝（熔断中或该通道排队已满），流式接口在开始响应前调用"""
+        self.breaker.ensure_available()
+        self.scheduler.check(lane)
+    
+    def resilience_stats(self) -> dict:
+        """上游调用的重试、对冲、熔断和录制回放统计"""
+        return {**self.upstream_stats, "breaker": self.breaker.stats(), "recording": self.recorder.stats()}
+    
+    async def _parse_output(self, content: str, schema: dict, lane: str):
+        """按schema解析模型输出，本地修复后仍不合格时让模型按格式修复一次，都失败时返回None"""
+        value, errors, repaired = structured_output.parse(content, schema)
+        if not errors:
+            self.output_stats["locally_repaired" if repaired else "parsed"] += 1
+            return value
+        
+        if LLM_JSON_REPAIR and content:
+            # 只整理格式，输入是上次的输出而不是原始题目或图片，比重新生成便宜
+            messages = [
+                {
+                    "role": "system",
+                    "content": f"""把用户给出的内容整理成JSON，只输出JSON本身，不要改写、增删其中的内容。
+格式：{structured_output.describe(schema)}"""
+                },
+                {"role": "user", "content": content}
+            ]
+            try:
+                response = await self._create(messages, temperature=0, max_tokens=2000, lane=lane, json_mode=True)
+                value, errors, _ = structured_output.parse(response.choices[0].message.content, schema)
+                if not errors:
+                    self.output_stats["model_repaired"] += 1
+                    return value
+            except Exception:
+                pass
+        
+        self.output_stats["failed"] += 1
+        return None
+    
+    def structured_output_stats(self) -> dict:
+        """结构化输出的解析统计"""
+        return {**self.output_stats, "json_mode": self.json_mode}
+    
+    async def _singleflight(self, key: str, call):
+        """同一键的调用进行中时直接等待其结果，否则发起新调用
+
+        call 为无参协程函数。单个等待者被取消不会取消共享的调用，其他等待者照常拿到结果。
+        """
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        result = await asyncio.shield(task)
+        if result is None:
+            # 流式解题的发起方中途断开，没有结果，改为自己发起调用
+            return await self._singleflight(key, call)
+        return result
+    
+    def _solve_messages(self, question: str, image_base64: str = None) -> list:
+        """构造解题请求的消息"""
         messages = [
             {
                 "role": "system",
@@ -49,34 +321,116 @@ class LLMService:
         else:
             messages.append({"role": "user", "content": question})
         
+        return messages
+    
+    async def _parse_solution(self, content: str) -> dict:
+        """解析解题结果JSON，无法解析时把原文作为答案（带 "parsed": False，调用方不应缓存）"""
+        result = await self._parse_output(content, SOLUTION_SCHEMA, "interactive")
+        if result is None:
+            return {
+                "answer": content,
+                "steps": [],
+                "knowledge_points": [],
+                "tips": "",
+                "parsed": False
+            }
+        return result
+    
+    @staticmethod
+    def _solve_key(question: str, image_base64: str = None) -> str:
+        """解题请求的合并键：规范化后的题目，图片题再加上图片的哈希"""
+        parts = ["solve", normalize_question(question)]
+        if image_base64:
+            parts.append(hashlib.sha256(image_base64.encode()).hexdigest())
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+    
+    async def solve_math_question(self, question: str, image_base64: str = None, timeout: float = None) -> dict:
+        """解答数理题目，返回分步骤解析
+
+        规范化后相同的题目（图片题还需图片相同）同时只调用一次LLM，返回的结果由各调用方共享，不要修改。
+        """
+        key = self._solve_key(question, image_base64)
+        
+        async def call():
+            messages = self._solve_messages(question, image_base64)
+            try:
+                response = await self._create(messages, temperature=0.7, max_tokens=2000, lane="interactive",
+                                              timeout=timeout, json_mode=True)
+                return await self._parse_solution(response.choices[0].message.content)
+            except LLMOverloaded:
+                raise
+            except Exception as e:
+                return {"error": str(e)}
+        
+        return await self._singleflight(key, call)
+    
+    async def solve_math_question_stream(self, question: str, image_base64: str = None, timeout: float = None):
+        """解答数理题目（流式）
+
+        依次产出 (事件, 数据)：answer、step（每个步骤）、knowledge_points、tips，
+        最后产出 result（完整解析结果）或 error。
+        与进行中的相同题目（流式或非流式）合并：等待其结果后只产出 result 或 error。
+        """
+        key = self._solve_key(question, image_base64)
+        task = self.inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            try:
+                result = await asyncio.shield(task)
+            except Exception as e:
+                yield "error", str(e)
+                return
+            if result is None:
+                # 发起方中途断开，改为自己调用
+                async for event, data in self.solve_math_question_stream(question, image_base64, timeout):
+                    yield event, data
+                return
+            if "error" in result:
+                yield "error", result["error"]
+            else:
+                yield "result", result
+            return
+        
+        # 其他请求等待这个结果；本次输出被中途关闭时结果为None，等待者各自重新调用
+        shared = asyncio.get_running_loop().create_future()
+        self.inflight[key] = shared
+        shared.add_done_callback(lambda _: self.inflight.pop(key, None))
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=2000
-            )
-            content = response.choices[0].message.content
-            # 尝试解析JSON
+            messages = self._solve_messages(question, image_base64)
+            parser = IncrementalJSONParser()
+            parts = []
+            
             try:
-                # 提取JSON部分
-                if "```json" in content:
-                    content = content.split("```json")[1].split("```")[0]
-                elif "```" in content:
-                    content = content.split("```")[1].split("```")[0]
-                return json.loads(content)
-            except:
-                return {
-                    "answer": content,
-                    "steps": [],
-                    "knowledge_points": [],
-                    "tips": ""
-                }
-        except Exception as e:
-            return {"error": str(e)}
+                async for delta in self._stream(messages, temperature=0.7, max_tokens=2000, lane="interactive",
+                                                timeout=timeout, json_mode=True):
+                    parts.append(delta)
+                    if parser is None:
+                        continue
+                    try:
+                        events = parser.feed(delta)
+                    except ValueError:
+                        # 输出不是合法JSON，等结束后整体解析
+                        parser = None
+                        continue
+                    for kind, field, value in events:
+                        if kind == "item" and field == "steps":
+                            yield "step", value
+                        elif kind == "field" and field in ("answer", "knowledge_points", "tips"):
+                            yield field, value
+            except Exception as e:
+                shared.set_result({"error": str(e)})
+                yield "error", str(e)
+                return
+            
+            result = await self._parse_solution("".join(parts))
+            shared.set_result(result)
+            yield "result", result
+        finally:
+            if not shared.done():
+                shared.set_result(None)
     
-    def review_essay(self, title: str, content: str, essay_type: str) -> dict:
-        """作文批改"""
+    async def review_essay(self, title: str, content: str, essay_type: str, timeout: float = None) -> dict:
+        """作文批改（后台任务，走 batch 通道）"""
         messages = [
             {
                 "role": "system",
@@ -124,26 +478,18 @@ class LLMService:
         ]
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=2000
-            )
-            content = response.choices[0].message.content
-            try:
-                if "```json" in content:
-                    content = content.split("```json")[1].split("```")[0]
-                elif "```" in content:
-                    content = content.split("```")[1].split("```")[0]
-                return json.loads(content)
-            except:
-                return {"overall_feedback": content, "overall_score": 0}
+            response = await self._create(messages, temperature=0.7, max_tokens=2000, lane="batch",
+                                          timeout=timeout, json_mode=True)
+            result = await self._parse_output(response.choices[0].message.content, ESSAY_SCHEMA, "batch")
+            # 不再以0分保存无法解析的结果，任务标记为失败
+            return result if result is not None else {"error": "批改结果格式错误，请重新提交"}
+        except LLMOverloaded:
+            raise
         except Exception as e:
             return {"error": str(e)}
     
-    def chat(self, messages: list, system_prompt: str = None) -> str:
-        """聊天助手"""
+    def _chat_messages(self, messages: list, system_prompt: str = None) -> list:
+        """拼接聊天助手的系统提示词和历史消息"""
         chat_messages = []
         
         if system_prompt:
@@ -160,59 +506,93 @@ class LLMService:
             })
         
         chat_messages.extend(messages)
+        return chat_messages
+    
+    async def chat(self, messages: list, system_prompt: str = None, timeout: float = None) -> str:
+        """聊天助手"""
+        chat_messages = self._chat_messages(messages, system_prompt)
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=chat_messages,
-                temperature=0.8,
-                max_tokens=1000
-            )
+            response = await self._create(chat_messages, temperature=0.8, max_tokens=1000, lane="interactive", timeout=timeout)
             return response.choices[0].message.content
+        except LLMOverloaded:
+            raise
         except Exception as e:
             return f"抱歉，出现了一些问题：{str(e)}"
     
-    def recommend_exercises(self, weak_points: list, subject: str) -> list:
+    async def chat_stream(self, messages: list, system_prompt: str = None, timeout: float = None):
+        """聊天助手（流式），逐段产出回复文本"""
+        chat_messages = self._chat_messages(messages, system_prompt)
+        
+        try:
+            async for delta in self._stream(chat_messages, temperature=0.8, max_tokens=1000, lane="interactive", timeout=timeout):
+                yield delta
+        except Exception as e:
+            yield f"抱歉，出现了一些问题：{str(e)}"
+    
+    async def summarize_chat(self, summary: str, messages: list, timeout: float = None) -> str:
+        """把早期对话并入摘要，失败时返回None"""
+        dialogue = "\n".join(
+            f"{'学生' if m['role'] == 'user' else '助手'}：{m['content']}" for m in messages
+        )
+        prompt = [
+            {
+                "role": "system",
+                "content": """你负责为学习助手的长对话维护摘要。
+请把已有摘要和新的对话内容合并成一段简洁的摘要（不超过300字），
+保留学生的年级、学科、正在讨论的问题、已给出的结论和学生的偏好，省略寒暄。只输出摘要本身。"""
+            },
+            {
+                "role": "user",
+                "content": f"已有摘要：{summary or '无'}\n\n新的对话：\n{dialogue}"
+            }
+        ]
+        
+        try:
+            response = await self._create(prompt, temperature=0.3, max_tokens=500, lane="batch", timeout=timeout)
+            return response.choices[0].message.content.strip()
+        except Exception:
+            return None
+    
+    async def recommend_exercises(self, weak_points: list, subject: str, count: int = 3,
+                                  difficulty: int = None, timeout: float = None) -> list:
         """根据薄弱知识点推荐练习题"""
+        request = f"学科：{subject}\n薄弱知识点：{', '.join(weak_points)}\n"
+        if difficulty:
+            request += f"难度：{difficulty}（1-5）\n"
+        request += f"请生成{count}道针对性练习题。"
+
         messages = [
             {
                 "role": "system",
                 "content": """你是一位教育专家，请根据学生的薄弱知识点生成针对性的练习题。
-请用JSON格式返回3道练习题：
-[
-    {
-        "question": "题目内容",
-        "options": ["A. 选项1", "B. 选项2", "C. 选项3", "D. 选项4"],
-        "answer": "A",
-        "explanation": "详细解析",
-        "knowledge_point": "涉及的知识点",
-        "difficulty": 3
-    }
-]"""
+请用JSON格式返回练习题：
+{
+    "exercises": [
+        {
+            "question": "题目内容",
+            "options": ["A. 选项1", "B. 选项2", "C. 选项3", "D. 选项4"],
+            "answer": "A",
+            "explanation": "详细解析",
+            "knowledge_point": "涉及的知识点",
+            "difficulty": 3
+        }
+    ]
+}"""
             },
             {
                 "role": "user",
-                "content": f"学科：{subject}\n薄弱知识点：{', '.join(weak_points)}\n请生成3道针对性练习题。"
+                "content": request
             }
         ]
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.8,
-                max_tokens=2000
-            )
-            content = response.choices[0].message.content
-            try:
-                if "```json" in content:
-                    content = content.split("```json")[1].split("```")[0]
-                elif "```" in content:
-                    content = content.split("```")[1].split("```")[0]
-                return json.loads(content)
-            except:
-                return []
-        except Exception as e:
+            response = await self._create(messages, temperature=0.8, max_tokens=2000, lane="recommend",
+                                          timeout=timeout, json_mode=True)
+            return await self._parse_output(response.choices[0].message.content, EXERCISES_SCHEMA, "recommend") or []
+        except LLMOverloaded:
+            raise
+        except Exception:
             return []
 
 
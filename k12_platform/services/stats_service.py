@@ -0,0 +1,171 @@
+"""学习统计服务 - 维护 user_stats 汇总表
+
+各 record_* 函数在调用方的会话中修改汇总行，由调用方和业务数据在同一事务中提交。
+计数列用 UPDATE ... SET col = col + 1 原子修改；JSON列在计数的UPDATE取得写锁（SQLite为数据库写锁，
+PostgreSQL为行锁）之后再读取和写回，并发写入不会互相覆盖。
+汇总行不存在时（老用户首次访问）在独立事务中按已提交的数据回填，并发回填时以先提交的为准。
+"""
+import json
+from datetime import date, timedelta
+from sqlalchemy import case, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models.database import AsyncSessionLocal, Question, Essay, WrongQuestion, UserStats
+
+RECENT_DAYS = 7
+
+
+def split_knowledge_points(knowledge_point: str) -> list:
+    """拆分逗号分隔的知识点"""
+    if not knowledge_point:
+        return []
+    return [kp.strip() for kp in knowledge_point.split(",") if kp.strip()]
+
+
+async def _backfill(user_id: int):
+    """根据已提交的数据生成汇总行"""
+    async with AsyncSessionLocal() as db:
+        wrong_count = await db.scalar(select(func.count(WrongQuestion.id)).where(
+            WrongQuestion.user_id == user_id,
+            WrongQuestion.is_mastered == False
+        ))
+        mastered_count = await db.scalar(select(func.count(WrongQuestion.id)).where(
+            WrongQuestion.user_id == user_id,
+            WrongQuestion.is_mastered == True
+        ))
+        essay_count, essay_score_sum = (await db.execute(
+            select(func.count(Essay.id), func.sum(Essay.overall_score)).where(Essay.user_id == user_id)
+        )).one()
+
+        weak_points = {}
+        rows = await db.execute(select(Question.knowledge_point).join(
+            WrongQuestion, WrongQuestion.question_id == Question.id
+        ).where(
+            WrongQuestion.user_id == user_id,
+            WrongQuestion.is_mastered == False
+        ))
+        for (knowledge_point,) in rows:
+            for kp in split_knowledge_points(knowledge_point):
+                weak_points[kp] = weak_points.get(kp, 0) + 1
+
+        since = date.today() - timedelta(days=RECENT_DAYS - 1)
+        day = func.date(Question.created_at)
+        daily_rows = await db.execute(select(day, func.count(Question.id)).where(
+            Question.user_id == user_id,
+            Question.created_at >= since
+        ).group_by(day))
+
+        stats = UserStats(
+            user_id=user_id,
+            total_questions=await db.scalar(select(func.count(Question.id)).where(Question.user_id == user_id)),
+            wrong_count=wrong_count,
+            mastered_count=mastered_count,
+            essay_count=essay_count or 0,
+            essay_score_sum=essay_score_sum or 0,
+            weak_points=json.dumps(weak_points, ensure_ascii=False),
+            daily_questions=json.dumps({str(d): c for d, c in daily_rows})
+        )
+        db.add(stats)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # 并发请求已经回填
+            pass
+
+
+async def get_user_stats(db: AsyncSession, user_id: int) -> UserStats:
+    """获取用户的汇总行，不存在时回填"""
+    query = select(UserStats).where(UserStats.user_id == user_id)
+    stats = await db.scalar(query)
+    if stats is None:
+        await _backfill(user_id)
+        stats = await db.scalar(query)
+    return stats
+
+
+async def _increment(db: AsyncSession, user_id: int, **values):
+    """原子地修改计数列，汇总行不存在时先回填"""
+    if await db.scalar(select(UserStats.user_id).where(UserStats.user_id == user_id)) is None:
+        await _backfill(user_id)
+    await db.execute(update(UserStats).where(UserStats.user_id == user_id).values(**values))
+
+
+async def _update_json(db: AsyncSession, user_id: int, column, change):
+    """读取JSON列、用 change 修改后写回（须在 _increment 之后调用，此时已持有写锁）"""
+    value = json.loads(await db.scalar(select(column).where(UserStats.user_id == user_id)) or "{}")
+    change(value)
+    await db.execute(update(UserStats).where(UserStats.user_id == user_id).values(
+        {column: json.dumps(value, ensure_ascii=False)}
+    ))
+
+
+def _adjust_weak_points(knowledge_point: str, delta: int):
+    def change(weak_points: dict):
+        for kp in split_knowledge_points(knowledge_point):
+            count = weak_points.get(kp, 0) + delta
+            if count > 0:
+                weak_points[kp] = count
+            else:
+                weak_points.pop(kp, None)
+    return change
+
+
+async def record_question(db: AsyncSession, user_id: int):
+    """新增一道题目"""
+    await _increment(db, user_id, total_questions=UserStats.total_questions + 1)
+
+    # 只保留最近几天的按天计数
+    def change(daily: dict):
+        today = str(date.today())
+        since = str(date.today() - timedelta(days=RECENT_DAYS - 1))
+        for d in [d for d in daily if d < since]:
+            del daily[d]
+        daily[today] = daily.get(today, 0) + 1
+    await _update_json(db, user_id, UserStats.daily_questions, change)
+
+
+async def record_wrong(db: AsyncSession, user_id: int, knowledge_point: str):
+    """加入错题本"""
+    await _increment(db, user_id, wrong_count=UserStats.wrong_count + 1)
+    await _update_json(db, user_id, UserStats.weak_points, _adjust_weak_points(knowledge_point, 1))
+
+
+async def record_mastered(db: AsyncSession, user_id: int, knowledge_point: str):
+    """错题标记为已掌握"""
+    await _increment(
+        db, user_id,
+        wrong_count=case((UserStats.wrong_count > 0, UserStats.wrong_count - 1), else_=0),
+        mastered_count=UserStats.mastered_count + 1
+    )
+    await _update_json(db, user_id, UserStats.weak_points, _adjust_weak_points(knowledge_point, -1))
+
+
+async def record_essay(db: AsyncSession, user_id: int, score: float):
+    """新增一篇批改后的作文"""
+    await _increment(
+        db, user_id,
+        essay_count=UserStats.essay_count + 1,
+        essay_score_sum=UserStats.essay_score_sum + (score or 0)
+    )
+
+
+def summarize(stats: UserStats) -> dict:
+    """转换为 /api/statistics 的返回格式"""
+    weak_points = sorted(json.loads(stats.weak_points or "{}").items(), key=lambda x: -x[1])[:5]
+    since = str(date.today() - timedelta(days=RECENT_DAYS - 1))
+    recent_questions = sum(c for d, c in json.loads(stats.daily_questions or "{}").items() if d >= since)
+    avg_score = stats.essay_score_sum / stats.essay_count if stats.essay_count else 0
+
+    return {
+        "total_questions": stats.total_questions,
+        "wrong_count": stats.wrong_count,
+        "mastered_count": stats.mastered_count,
+        "essay_count": stats.essay_count,
+        "avg_essay_score": round(avg_score, 1),
+        "weak_points": [{"name": wp[0], "count": wp[1]} for wp in weak_points],
+        "recent_questions": recent_questions,
+        "accuracy_rate": round((1 - stats.wrong_count / max(stats.total_questions, 1)) * 100, 1)
+    }
@@ -0,0 +1,249 @@
+"""LLM结构化输出解析 - 单遍提取JSON、本地修复，并按任务schema校验和纠正类型
+
+模型输出可能带代码块标记和前后说明文字、尾随逗号，或因 max_tokens 截断而缺少结尾。
+extract_json 从第一个 { （数组结果为 { 或 [）开始扫描一遍找到完整的JSON值；解析失败时在本地修复（去掉尾随逗号、
+补全截断的字符串和括号），不需要重新调用模型。validate 按schema把字段纠正为约定的类型，
+缺少必填字段时返回错误，由调用方决定是否让模型修复。
+"""
+import re
+import json
+
+SOLUTION_SCHEMA = {
+    "type": "object",
+    "required": ["answer"],
+    "fields": {
+        "answer": "str",
+        "steps": "list[str]",
+        "knowledge_points": "list[str]",
+        "tips": "str"
+    }
+}
+
+ESSAY_SCHEMA = {
+    "type": "object",
+    "required": ["overall_score"],
+    "fields": {
+        "overall_score": "int",
+        "topic_analysis": "dict",
+        "structure": "dict",
+        "grammar": "dict",
+        "vocabulary": "dict",
+        "overall_feedback": "str",
+        "suggestions": "list[str]"
+    },
+    "ranges": {"overall_score": (0, 100)}
+}
+
+EXERCISE_SCHEMA = {
+    "type": "object",
+    "required": ["question"],
+    "fields": {
+        "question": "str",
+        "options": "list[str]",
+        "answer": "str",
+        "explanation": "str",
+        "knowledge_point": "str",
+        "difficulty": "int"
+    },
+    "ranges": {"difficulty": (1, 5)}
+}
+
+# 练习题为数组；JSON模式下模型只能返回对象，因此也接受 {"exercises": [...]}
+EXERCISES_SCHEMA = {"type": "list", "key": "exercises", "items": EXERCISE_SCHEMA}
+
+_TYPE_NAMES = {"str": "字符串", "int": "整数", "list[str]": "字符串数组", "dict": "对象"}
+_DEFAULTS = {"str": "", "list[str]": [], "dict": {}}
+
+
+def _scan(text: str, start: int):
+    """从 start 处的 { 或 [ 扫描到与之匹配的结束位置
+
+    返回 (结束位置, 未闭合的括号栈, 是否停在字符串内, 最后一个字符串外逗号的 (位置, 栈深度))，
+    未找到匹配的结尾时结束位置为None。
+    """
+    stack = []
+    in_string = False
+    escape = False
+    last_comma = None
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack and stack[-1] == ch:
+                stack.pop()
+            if not stack:
+                return i + 1, stack, False, last_comma
+        elif ch == ",":
+            last_comma = (i, len(stack))
+    return None, stack, in_string, last_comma
+
+
+def _strip_trailing_commas(text: str) -> str:
+    """去掉字符串外、紧跟在 } 或 ] 前的逗号"""
+    result = []
+    in_string = False
+    escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "}]":
+            while result and result[-1].isspace():
+                result.pop()
+            if result and result[-1] == ",":
+                result.pop()
+        result.append(ch)
+    return "".join(result)
+
+
+def _loads(text: str):
+    # strict=False：允许字符串中出现未转义的换行，模型输出中很常见
+    return json.loads(text, strict=False)
+
+
+def repair_json(segment: str):
+    """本地修复一段不完整或稍有错误的JSON，失败时抛出 ValueError"""
+    text = _strip_trailing_commas(segment)
+    end, stack, in_string, last_comma = _scan(text, 0)
+    if end is not None:
+        return _loads(text[:end])
+
+    # 输出被截断：先补全字符串和括号，不行再退回到最后一个完整的元素
+    candidates = [(text + ('"' if in_string else "")).rstrip().rstrip(",:") + "".join(reversed(stack))]
+    if last_comma is not None:
+        position, depth = last_comma
+        candidates.append(text[:position] + "".join(reversed(stack[:depth])))
+    for candidate in candidates:
+        try:
+            return _loads(candidate)
+        except ValueError:
+            continue
+    raise ValueError("JSON无法修复")
+
+
+def extract_json(text: str, starts: str = "{[", max_candidates: int = 5):
+    """从模型输出中提取JSON值，返回 (值, 是否经过修复)，找不到JSON时抛出 ValueError
+
+    starts 为JSON值可能的起始字符。优先从 ```json 代码块开始找；
+    前面的说明文字里出现的括号不是JSON时，依次尝试后面的起点。
+    """
+    text = text or ""
+    fence = text.find("```json")
+    offset = fence + 7 if fence >= 0 else 0
+    pattern = "[" + re.escape(starts) + "]"
+    for count, match in enumerate(re.finditer(pattern, text[offset:])):
+        if count >= max_candidates:
+            break
+        start = offset + match.start()
+        end = _scan(text, start)[0]
+        if end is None:
+            # 没有结尾，多半是输出被截断
+            return repair_json(text[start:]), True
+        try:
+            return _loads(text[start:end]), False
+        except ValueError:
+            try:
+                return repair_json(text[start:end]), True
+            except ValueError:
+                continue
+    raise ValueError("输出中没有JSON")
+
+
+def _coerce(value, kind: str):
+    """把字段值纠正为约定类型，无法纠正时抛出 ValueError"""
+    if value is None:
+        raise ValueError
+    if kind == "str":
+        if isinstance(value, str):
+            return value
+        if isinstance(value, list):
+            return "\n".join(_coerce(v, "str") for v in value if v is not None)
+        if isinstance(value, (int, float)):
+            return str(value)
+        return json.dumps(value, ensure_ascii=False)
+    if kind == "int":
+        if isinstance(value, bool):
+            raise ValueError
+        if isinstance(value, (int, float)):
+            return int(round(value))
+        match = re.search(r"-?\d+(?:\.\d+)?", str(value))  # 如 "85分"
+        if match is None:
+            raise ValueError
+        return int(round(float(match.group())))
+    if kind == "list[str]":
+        if isinstance(value, list):
+            return [_coerce(v, "str") for v in value if v is not None]
+        if isinstance(value, str):
+            return [line.strip() for line in value.splitlines() if line.strip()]
+        raise ValueError
+    if kind == "dict":
+        if isinstance(value, dict):
+            return value
+        raise ValueError
+    raise ValueError
+
+
+def validate(data, schema: dict):
+    """按schema校验并纠正类型，返回 (纠正后的值, 错误列表)；未列出的字段原样保留"""
+    if schema["type"] == "list":
+        if isinstance(data, dict):
+            data = data.get(schema["key"])
+        if not isinstance(data, list):
+            return None, [f"应为数组或包含 {schema['key']} 字段的对象"]
+        items = [item for item, errors in (validate(item, schema["items"]) for item in data) if not errors]
+        return items, ([] if items else ["没有有效的元素"])
+
+    if not isinstance(data, dict):
+        return None, ["应为JSON对象"]
+    result = dict(data)
+    errors = []
+    for name, kind in schema["fields"].items():
+        try:
+            result[name] = _coerce(data.get(name), kind)
+            if name in schema.get("required", []) and result[name] in ("", []):
+                raise ValueError
+        except ValueError:
+            if name in schema.get("required", []):
+                errors.append(f"缺少字段或类型错误：{name}")
+            elif kind in _DEFAULTS:
+                result[name] = type(_DEFAULTS[kind])()
+            else:
+                result.pop(name, None)
+    for name, (low, high) in schema.get("ranges", {}).items():
+        if isinstance(result.get(name), int):
+            result[name] = min(max(result[name], low), high)
+    return result, errors
+
+
+def parse(text: str, schema: dict):
+    """提取并校验，返回 (值, 错误列表, 是否经过本地修复)"""
+    try:
+        data, repaired = extract_json(text, "{" if schema["type"] == "object" else "{[")
+    except ValueError as e:
+        return None, [str(e)], False
+    value, errors = validate(data, schema)
+    return value, errors, repaired
+
+
+def describe(schema: dict) -> str:
+    """生成schema的简短格式说明，用于让模型修复输出"""
+    if schema["type"] == "list":
+        return f'{{"{schema["key"]}": [{describe(schema["items"])}]}}'
+    fields = ", ".join(f'"{name}": {_TYPE_NAMES[kind]}' for name, kind in schema["fields"].items())
+    return f"{{{fields}}}（必填：{'、'.join(schema.get('required', []))}）"
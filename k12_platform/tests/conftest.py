@@ -0,0 +1,13 @@
+"""测试配置 - 使用临时SQLite数据库，在导入应用之前设置环境变量"""
+import os
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP_DIR = tempfile.mkdtemp()
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TMP_DIR, 'test.db')}"
+os.environ["ANSWER_CACHE_DB"] = ""
+os.environ["BCRYPT_ROUNDS"] = "4"
+os.environ["OPENAI_BASE_URL"] = "http://127.0.0.1:9/v1"  # 测试不应调用LLM
+sys.path.insert(0, BASE_DIR)
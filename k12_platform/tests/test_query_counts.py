@@ -0,0 +1,74 @@
+"""列表和统计接口的SQL查询数不随数据行数增长"""
+import json
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from main import app
+from models.database import (
+    async_engine, init_db, SessionLocal, Question, Answer, WrongQuestion, KnowledgePoint, Exercise
+)
+
+ENDPOINTS = ["/api/wrong-book", "/api/wrong-book/mastered", "/api/statistics", "/api/recommend", "/api/history"]
+POINTS = ["一元一次方程", "因式分解"]
+
+
+@pytest.fixture(scope="module")
+def client():
+    init_db()
+    with TestClient(app) as client:
+        r = client.post("/api/register", data={"username": "query_count", "password": "password123"})
+        assert r.status_code == 200
+        client.user_id = r.json()["user_id"]
+        with SessionLocal() as db:
+            # 题库中有足够的题目，推荐接口不调用LLM
+            db.add_all(
+                Exercise(subject="数学", knowledge_point=name, difficulty=2, content=f"{name}练习{i}",
+                         options="[]", answer="A", explanation="", source="import")
+                for name in POINTS for i in range(5)
+            )
+            db.commit()
+        yield client
+
+
+def add_wrong_questions(user_id: int, count: int):
+    """新增错题（一半已掌握），每道题带答案和知识点"""
+    with SessionLocal() as db:
+        points = {name: db.query(KnowledgePoint).filter_by(name=name).first() or KnowledgePoint(name=name)
+                  for name in POINTS}
+        for i in range(count):
+            question = Question(user_id=user_id, content=f"题目{i}", subject="数学", knowledge_point=",".join(POINTS),
+                                knowledge_points=list(points.values()))
+            question.answer = Answer(content=f"答案{i}", steps=json.dumps(["步骤1", "步骤2"]))
+            db.add(question)
+            db.add(WrongQuestion(user_id=user_id, question=question, error_reason="计算错误", is_mastered=i % 2 == 1))
+        db.commit()
+
+
+def count_queries(client, url: str) -> int:
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        r = client.get(url)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    assert r.status_code == 200, r.text
+    return len(statements)
+
+
+@pytest.mark.parametrize("url", ENDPOINTS)
+def test_query_count_does_not_grow_with_rows(client, url):
+    add_wrong_questions(client.user_id, 4)
+    # 首次访问可能回填统计汇总行、验证令牌，不计入
+    client.get(url)
+    few = count_queries(client, url)
+
+    add_wrong_questions(client.user_id, 40)
+    many = count_queries(client, url)
+
+    assert many == few
+    assert few <= 6
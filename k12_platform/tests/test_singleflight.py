@@ -0,0 +1,53 @@
+"""相同题目的并发流式解题请求只调用一次LLM"""
+import json
+import asyncio
+import httpx
+
+from main import app
+from models.database import init_db
+from services.llm_service import llm_service
+
+SOLUTION = {"answer": "x = 2", "steps": ["步骤1：移项", "步骤2：两边同除以3"], "knowledge_points": ["一元一次方程"], "tips": "先移项"}
+
+
+def parse_events(text: str) -> list:
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_concurrent_stream_requests_share_one_call(monkeypatch):
+    calls = []
+
+    async def fake_stream(messages, temperature, max_tokens, lane, timeout=None, json_mode=False):
+        calls.append(messages[-1]["content"])
+        text = json.dumps(SOLUTION, ensure_ascii=False)
+        for i in range(0, len(text), 10):
+            await asyncio.sleep(0.01)
+            yield text[i:i + 10]
+
+    monkeypatch.setattr(llm_service, "_stream", fake_stream)
+    init_db()
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.post("/api/register", data={"username": "singleflight", "password": "password123"})
+            assert r.status_code == 200
+            return await asyncio.gather(*[
+                client.post("/api/question/stream", data={"content": "解方程 3x + 1 = 7"}) for _ in range(5)
+            ])
+
+    responses = asyncio.run(run())
+
+    assert len(calls) == 1
+    for r in responses:
+        assert r.status_code == 200
+        events = parse_events(r.text)
+        names = [name for name, _ in events]
+        assert names[0] == "answer" and names[-1] == "done"
+        assert [data["content"] for name, data in events if name == "step"] == SOLUTION["steps"]
+        assert ("knowledge_points", SOLUTION["knowledge_points"]) in events
+        assert ("tips", SOLUTION["tips"]) in events